@@ -1,29 +1,45 @@
-import ast
-from copy import deepcopy
-from analyzer import Transformer, make_output_folder, transform_helper, init_output
-from analyzer.utils import OutputHandler
-import os, glob
+from analyzer import default_settings, make_output_folder, transform_batch, init_worker, preload_modules, ResultCache, LogWriter, ProfileReport, PatternStats
+from functools import partial
+from analyzer.scheduler import default_workers, file_size, stream_batches, run_batches
+from analyzer.discovery import discover
+from analyzer.patch import PatchWriter
+from analyzer.mirror import MODES as MIRROR_MODES, mirror_tree, place_file
+import os
 import argparse
 import shutil
 from pathlib import Path
 import concurrent.futures
 import threading
-from tqdm import tqdm
 import time
+import sys
 
 
 parser = argparse.ArgumentParser(description="Analyzes and transforms python projects.")
-parser.add_argument("path", metavar='PATH', type=str, nargs=1, help="path to the directory / python file")
+parser.add_argument("path", metavar='PATH', type=str, nargs='?', help="path to the directory / python file")
 parser.add_argument('-i', '--inline',          dest='mode',    action='store_const', const="inline", default="copy", help='transform inline (default makes a copy)')
 parser.add_argument('-o', '--overwrite',       dest='ow',      action='store_const', const="Y",      default=None,   help="automatically overwrite files, when not transforming inline")
-# parser.add_argument('-t', '--test',            dest='test',   action='store_const', const=True,      default=False,   help="run in test mode, provides additional info on runtime and memory usage, etc.")
-# parser.add_argument('-mt','--max-threads',dest='max_threads', const=None, default=None, type=int, help='maximum number of threads to use', nargs=1)
-# parser.add_argument('-p','--p-name',dest='proj_name', const=None, default=None, type=str, help='name of the project, used to label test data', nargs=1)
+parser.add_argument('-c', '--changed-since',   dest='ref',     default=None, metavar='REF', help="only transform the files, that were added or modified in the git work tree or index relative to REF")
+parser.add_argument('-l', '--changed-lines',   dest='changed_lines', action='store_true', help="with --changed-since, only transform the If-nodes overlapping the changed lines")
+parser.add_argument('-u', '--unchanged',       dest='unchanged', choices=MIRROR_MODES, default='reflink', help="when making a copy, how to place the files not changed by the transformation: reflink (copy-on-write clone, falling back to a copy; default), copy, hardlink (shares the files with the original), or skip (the copy only has the transformed files)")
+parser.add_argument('-e', '--exclude',         dest='excludes', action='append', default=[], metavar='GLOB', help="skip the files and folders matching GLOB (by name, or path relative to PATH), on top of the [DISCOVERY] Exclude option. Can be given more than once")
+parser.add_argument('--no-gitignore',          dest='gitignore', action='store_false', help="don't skip the files ignored by .gitignore")
+parser.add_argument('-j', '--jobs',            dest='jobs',    type=int, default=None, metavar='N', help="number of workers (default: the number of CPUs available to the process, honouring CPU affinity and cgroup quotas)")
+parser.add_argument('-b', '--backend',         dest='backend', choices=('processes', 'threads'), default=None, help="transform files in a process pool (default), or a thread pool in this interpreter. Threads pay off on free-threaded builds, and for small projects. A single file is transformed in this interpreter by default")
+parser.add_argument('-s', '--start-method',    dest='start_method', choices=('fork', 'spawn', 'forkserver'), default=None, help="how to start the worker processes (default: the platform's default, not every method is available everywhere). forkserver preloads the analyzer once, so every worker starts with it already imported")
+parser.add_argument('-t', '--test',            dest='test',   action='store_const', const=True,      default=False,   help="run in test mode, provides additional info on runtime and memory usage, etc. written to test-data/")
+parser.add_argument('-p', '--p-name',          dest='proj_name', default=None, type=str, help='name of the project, used to label test data')
+parser.add_argument('--profile',               dest='profile', nargs='?', const='', default=None, metavar='FILE', help="measure the wall and CPU time of each phase (read, parse, analyze, unparse, write, ...) of every file, and write a JSON report of them, with the slowest files (default: profile.json in the output folder)")
+parser.add_argument('--profile-memory',        dest='profile_memory', action='store_true', help="with --profile (implied), measure the peak memory of every file too. Tracing the allocations slows every phase down, so its times are only comparable to other runs with --profile-memory")
+parser.add_argument('-O', '--option',          dest='options', action='append', default=[], metavar='NAME=VALUE', help="override an option of config.ini for this run, e.g. -O MinimumBranches=2 -O AllowFlattening=true. Can be given more than once")
+parser.add_argument('--daemon',                dest='daemon', action='store_true', help="instead of transforming PATH, keep running with warm workers, answering line-delimited JSON requests on stdin (see analyzer/daemon.py). Uses -j workers (default: 1) of the -b backend (default: threads)")
+parser.add_argument('--socket',                dest='socket', default=None, metavar='SOCKET', help="with --daemon, serve the connections of a Unix socket at SOCKET instead of stdin")
+parser.add_argument('--stats',                 dest='stats', default=None, metavar='FILE', help="write the counters of the run to FILE: the visits, matches and time of each pattern, and the rejected If-nodes by reason. In the Prometheus text format if FILE ends with .prom, as JSON otherwise")
 
 
 TEST_DATA = {
     "project_size_MiB" : 0,
     "no_files" : 0,
+    "no_files_skipped" : 0,
     "cloc_py": {},
     "no_nodes_visited" : 0,
     "no_nodes_transformed" : 0,
@@ -35,35 +51,74 @@ TEST_DATA = {
 
 
 
-def _test_helper(path, _max_workers):
-    global TEST_DATA
-    files_to_transform = [f for f in path.rglob('*.py')] if path.is_dir() else [path]
-
-    with concurrent.futures.ProcessPoolExecutor(max_workers=_max_workers, initializer=init_output, initargs=(OutputHandler.OUTPUT_FOLDER,)) as executor:
-        results = list(tqdm(executor.map(transform_helper, files_to_transform), total=len(files_to_transform)))
-
-    TEST_DATA["no_files"] = len(files_to_transform)
-    TEST_DATA["max_workers"] = _max_workers if _max_workers is not None else 12
-    for res in results:
-        TEST_DATA["no_nodes_visited"] += res[0]
-        TEST_DATA["no_nodes_transformed"] += res[1]
-
-
-def _test_main(path, max_workers):
-    from datetime import timedelta
-    from memory_profiler import memory_usage
-    global TEST_DATA
-
-    start_time = time.monotonic()
-    #mem = max(memory_usage((_test_helper, (path, max_workers), {})))
-    _test_helper(path, max_workers)
-    end_time = time.monotonic()
+def make_executor(backend, max_workers, output_folder=None, start_method=None, profile=False, settings=None):
+    """
+    Returns the pool of workers, each of them warmed up by init_worker. start_method: the multiprocessing start method of the processes.
+    settings: the Settings of the workers, they get it once through the initializer.
+    """
+    initargs = (output_folder, profile, settings)
+    if backend == 'threads':
+        return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, initializer=init_worker, initargs=initargs)
+    context = None
+    if start_method is not None:
+        import multiprocessing  # Not needed by the thread pool, so it is imported only here
+        context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            # Every worker gets forked from a server, that has already imported the analyzer and its patterns
+            context.set_forkserver_preload(preload_modules())
+    return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                                  initializer=init_worker, initargs=initargs)
+
+
+def run_daemon(args, settings):
+    from analyzer.daemon import Daemon
+    jobs = args.jobs if args.jobs is not None else 1
+    if jobs < 1:
+        parser.error("--jobs must be at least 1!")
+    with Daemon(settings, jobs, args.backend or 'threads') as daemon:
+        print(f"transpy daemon ready, {jobs} {args.backend or 'threads'} worker(s), serving {args.socket or 'stdin'}", file=sys.stderr)
+        if args.socket is not None:
+            daemon.serve_socket(args.socket)
+        else:
+            daemon.serve_stdio()
+
+
+def make_progress():
+    """Returns the progress bar of the files, or a silent stand-in, when tqdm is not installed. Imported here, since it is slow to import."""
+    try:
+        from tqdm import tqdm
+    except ImportError:
+        return _NoProgress()
+    # Only the main thread updates the bar. The default lock of tqdm would import multiprocessing for a lock, that is never needed
+    tqdm.set_lock(threading.RLock())
+    return tqdm(total=0, unit="file")
+
+
+class _NoProgress:
+    total = 0
+
+    def update(self, n=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def peak_memory_MiB():
+    """Returns the peak RSS of this process, and of its largest worker process, or None where it cannot be measured."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # Kilobytes on Linux, bytes on macOS
+    unit = 1048576 if sys.platform == "darwin" else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / unit
 
-    TEST_DATA["runtime_s"] = timedelta(seconds=end_time - start_time).total_seconds()
-    TEST_DATA["max_memory_MiB"] = None
 
 def _write_test_data(project):
-    import json
     n = 1
     TEST_DATA_BASE = Path(__file__).parent.resolve() / 'test-data'
 
@@ -77,6 +132,7 @@ def _write_test_data(project):
         testdatapath = (TEST_DATA_BASE / f'TEST_DATA_{project}({n}).json').resolve()
 
     print(f"Writing test data in: {testdatapath}")
+    import json
     with open(testdatapath, "w") as f:
         json.dump(TEST_DATA, f, indent=4)
 
@@ -101,31 +157,67 @@ def onerror(func, path, exc_info):
 
 
 
-def make_copy(schizo, newPath):
+def prepare_copy(path, newPath, mode):
+    """Removes the previous copy, and starts placing the unchanged files in a background thread, overlapping the transformation."""
     prompt = "Overwriting" if newPath.exists() else "Creating"
     print(f"{prompt} '{newPath}'")
-    path = schizo[0]
+    if newPath.is_dir() and not newPath.is_symlink():
+        shutil.rmtree(newPath, onerror=onerror)
+    elif newPath.exists() or newPath.is_symlink():
+        os.unlink(newPath)
+
     if path.is_dir():
-        if newPath.exists():
-            shutil.rmtree(newPath, onerror=onerror)
-        schizo[0] = shutil.copytree(path, newPath)
+        os.makedirs(newPath)
+        target, args = mirror_tree, (path, newPath, mode)
     else:
-        schizo[0] = shutil.copy(path,newPath)
+        target, args = place_file, (path, newPath, mode)
+    thread = threading.Thread(target=target, args=args, name="Mirroring thread", daemon=True)
+    thread.start()
+    return thread
 
 def main():
     args = parser.parse_args()
-    path = Path(args.path[0]).resolve()
+    if any("=" not in option for option in args.options):
+        parser.error("--option expects NAME=VALUE!")
+    try:
+        settings = default_settings().with_options(option.partition("=")[::2] for option in args.options)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.daemon:
+        return run_daemon(args, settings)
+    if args.path is None:
+        parser.error("PATH is required, unless running with --daemon!")
+
+    path = Path(args.path).resolve()
     files_to_transform = []
     ow = args.ow
-    test_mode = False
-    max_threads = None
-    # DEFAULT max_workers = 12
-    # MAX max_workers = 61
+    test_mode = args.test
+    max_threads = args.jobs if args.jobs is not None else default_workers()
 
 
     if not path.exists():
         parser.error("Given path does not exist!")
 
+    if max_threads < 1:
+        parser.error("--jobs must be at least 1!")
+
+    if args.changed_lines and args.ref is None:
+        parser.error("--changed-lines requires --changed-since!")
+
+    changed = None # Mapping changed files (relative to the given path) to their changed line ranges
+    if args.ref is not None:
+        from analyzer.vcs import changed_files, GitError  # Only needed here, spares importing subprocess otherwise
+        try:
+            changed = changed_files(path, args.ref, with_lines=args.changed_lines)
+        except GitError as error:
+            parser.error(f"Cannot get changed files: {error}")
+        base = path if path.is_dir() else path.parent
+        changed = {f.relative_to(base): ranges for f, ranges in changed.items()}
+        if not changed:
+            print("No changed python files.")
+            return
+
     if args.mode == "copy":
         newPath = (path.parent / f"transformed-{path.parts[-1]}")
         if newPath.exists():
@@ -137,33 +229,106 @@ def main():
                 print("Quitting")
                 return
 
-        path = [path]
-        #make_copy(path, newPath)
-        thread = threading.Thread(target = make_copy, args = (path, newPath), name="Copying thread")
-        thread.start()
-        eli_count = 0
-        while thread.is_alive():
-            print('Copying files', '.'*(eli_count+1), ' '*(2-eli_count), end='\r')
-            eli_count = (eli_count + 1) % 3
-            time.sleep(0.1)
-        thread.join()
-        path = path[0]
-        print('Done                 ')
-
-    make_output_folder(path)
+        mirror = prepare_copy(path, newPath, args.unchanged)
+    else:
+        newPath = None
+        mirror = None
+
+    output_folder = make_output_folder(newPath or path, settings)
+
+    profile = None
+    profile_mode = False  # What the workers measure: False (nothing), True (the times), or "memory" (the times and the peak memory)
+    if args.profile is not None or args.profile_memory:
+        profile = ProfileReport()
+        profile_mode = "memory" if args.profile_memory else True
+        profile_path = Path(args.profile) if args.profile else Path(output_folder or ".") / "profile.json"
+
+    base = path if path.is_dir() else path.parent
+    if changed is not None:
+        sources = ((base / f, ranges, file_size(base / f)) for f, ranges in changed.items())
+    elif path.is_dir():
+        excludes = list(settings.exclude) + args.excludes
+        use_gitignore = settings.use_gitignore and args.gitignore
+        sources = ((Path(f), None, size) for f, size in discover(path, excludes, use_gitignore))
+    else:
+        sources = iter([(path, None, file_size(path))])
+
+    # With a known handful of files (pre-commit hooks), starting workers would take longer than the work
+    known_files = len(changed) if changed is not None else (None if path.is_dir() else 1)
+    if known_files is not None:
+        max_threads = min(max_threads, known_files)
+    backend = args.backend or ('threads' if known_files == 1 else 'processes')
+
+    progress = make_progress()
+
+    def items():
+        # Files get scheduled as they are discovered
+        for file, ranges, size in sources:
+            target = None if newPath is None else (newPath / file.relative_to(path) if path.is_dir() else newPath)
+            progress.total += 1
+            TEST_DATA["project_size_MiB"] += size / 1048576
+            yield (file, ranges, target), size
+
+    # Largest files of each window first, the small ones batched together
+    batches = ([item for item, _ in batch] for batch in stream_batches(items(), size_of=lambda pair: pair[1]))
+    no_files = skipped = cached = visited = transformed = 0
+    stats = PatternStats()
+    start = time.perf_counter()
+    with make_executor(backend, max_threads, output_folder, args.start_method, profile_mode, settings) as executor, progress, \
+            LogWriter(output_folder) as logs, PatchWriter(output_folder) as patch:
+        func = partial(transform_batch, output_folder=output_folder, profile=profile_mode)
+        for item, res in run_batches(executor, func, batches, max_in_flight=4 * max_threads):
+            no_files += 1
+            visited += res[0]
+            transformed += res[1]
+            skipped += res[2]
+            cached += res[3]
+            logs.write(res[4])
+            patch.write(item[0].relative_to(base).as_posix(), res[5])
+            if profile is not None:
+                profile.add(res[6])
+            stats.merge(res[7])
+            progress.update()
+    runtime = time.perf_counter() - start
+
+    if mirror is not None:
+        if mirror.is_alive():
+            print("Waiting for the unchanged files to be placed..")
+        mirror.join()
+
+    if skipped:
+        print(f"Pre-filter skipped {skipped} of {no_files} files.")
+    if cached:
+        print(f"{cached} of {no_files} files were unchanged since they were cached.")
+
+    cache = ResultCache.from_config(settings)
+    if cache is not None:
+        cache.evict()
+
+    if profile is not None:
+        report = profile.as_dict(project=str(path), jobs=max_threads, backend=backend, elapsed_s=runtime, max_memory_MiB=peak_memory_MiB())
+        print(f"Writing the profile in: {profile_path}")
+        import json
+        with open(profile_path, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if args.stats is not None:
+        print(f"Writing the pattern counters in: {args.stats}")
+        stats.write(args.stats)
 
     if test_mode:
-        p_name = args.proj_name[0]
-        if not p_name:
-            p_name = "unknown"
-        TEST_DATA["project"] = p_name
-        _test_main(path, max_threads)
+        p_name = args.proj_name or "unknown"
+        TEST_DATA.update({
+            "no_files": no_files,
+            "no_files_skipped": skipped,
+            "no_nodes_visited": visited,
+            "no_nodes_transformed": transformed,
+            "runtime_s": runtime,
+            "max_memory_MiB": peak_memory_MiB(),
+            "max_workers": max_threads,
+            "project": p_name,
+        })
         _write_test_data(p_name)
-        return
-
-    files_to_transform = [f for f in path.rglob('*.py')] if path.is_dir() else [path]
-    with concurrent.futures.ProcessPoolExecutor(max_workers=max_threads, initializer=init_output, initargs=(OutputHandler.OUTPUT_FOLDER,)) as executor:
-        results = list(tqdm(executor.map(transform_helper, files_to_transform), total=len(files_to_transform)))
 
 
 if __name__ == "__main__":
@@ -1,45 +1,95 @@
-import ast
-# TODO maybe not like this
-def custom_hash(self):
-    return hash(ast.dump(self))
-
-def custom_eq(self, other):
-    return hash(self) == hash(other)
-
-ast.AST.__hash__ = custom_hash
-ast.AST.__eq__ = custom_eq
-
 from pathlib import Path
-from configparser import ConfigParser
+from functools import lru_cache
 import os
-import glob
 import shutil
+import threading
 
 conf_file = Path(__file__).parent / 'config.ini'
-config = ConfigParser()
-config.read(conf_file)
+
+from .settings import Settings
+
+
+@lru_cache(maxsize=1)
+def default_settings():
+    """Returns the Settings of config.ini, read and parsed on the first call only. Raises ValueError on a missing or invalid option."""
+    from configparser import ConfigParser
+    config = ConfigParser()
+    config.read(conf_file)
+    return Settings.from_config(config)
+
 
 from .analyzer import Analyzer
-from .transformer import Transformer
-from .utils import OutputHandler
+from .transformer import Transformer, TransformResult, NodeResult
+from .utils import OutputHandler, LogWriter
+from .cache import ResultCache
+from .profiler import Profiler, ProfileReport
+from .stats import PatternStats, Rejection
+
+
+def transform_source(source, line_ranges=None, settings=None):
+    """
+    Transforms python source code in memory, without any disk I/O. Returns a TransformResult,
+    holding the transformed text, and a NodeResult for every transformed If-node.
+    settings: the Settings to use (default: the ones of config.ini).
+    Raises SyntaxError, if the source is not valid python.
+    """
+    return Transformer(settings=settings).transform_source(source, line_ranges)
+
 
-def transform_helper(file):
-    tr = Transformer()
-    tr.transform(file)
+_worker = threading.local()  # The reusable Transformer of the worker process (or thread)
+
+
+def _worker_transformer(output_folder, profile=False):
+    settings = getattr(_worker, "settings", None) or default_settings()
+    tr = getattr(_worker, "transformer", None)
+    if tr is None or tr.output_folder != output_folder or tr.settings != settings:
+        tr = _worker.transformer = Transformer(output_folder, settings)
+    if profile and (tr.profiler is None or tr.profiler.memory != (profile == "memory")):
+        tr.profiler = Profiler(memory=profile == "memory")
+    return tr
+
+
+def init_worker(output_folder=None, profile=False, settings=None):
+    """
+    Initializer of the pool workers: loads the patterns, and creates the Transformer of the worker once,
+    so the per-file work is just parsing and analysis.
+    profile: profile every file, see Profiler: True measures the times, "memory" the peak memory too.
+    settings: the Settings of the worker's Transformer (default: the ones of config.ini).
+    """
+    _worker.settings = settings if settings is not None else default_settings()
+    _worker_transformer(output_folder, profile)
+
+
+def preload_modules():
+    """Returns the modules worth importing in the forkserver, so the workers forked from it start with them loaded."""
+    from .registry import BUILTIN_PATTERNS
+    return ["analyzer", "analyzer.transformer", "tokenize"] + [module for module, _ in BUILTIN_PATTERNS]
+
+
+def transform_helper(file, line_ranges=None, target=None, output_folder=None, profile=False):
+    tr = _worker_transformer(output_folder, profile)
+    if profile:
+        tr.profiler.start_file(file)
+    result = tr.transform(file, line_ranges, target)
     # print((tr.visited_nodes,"\n......................\n",  tr.results.keys()))
-    return (tr.visited_nodes, len(tr.results.keys()))
+    # The log records and the pattern counters go back to the main process with the result, which is the only one writing them
+    return (tr.visited_nodes, len(result.nodes) if result else 0, tr.skipped, tr.cached, tr.drain_logs(), tr.diff,
+            tr.profiler.end_file() if profile else None, tr.analyzer.stats.drain())
+
 
+def transform_batch(items, output_folder=None, profile=False):
+    """Runs transform_helper on every (file, line_ranges, target) item, returning the list of results. One task of the pool."""
+    return [transform_helper(*item, output_folder=output_folder, profile=profile) for item in items]
 
-# Needed for ProcessPoolExecutor init, since new processes dont get the static variable
-def init_output(path):
-    OutputHandler.OUTPUT_FOLDER = path
 
-def make_output_folder(default_path):
-    if not config["OUTPUT"].getboolean("AllowOutput"):
-        return
+def make_output_folder(default_path, settings=None):
+    """Creates the output folder, based on the settings (default: config.ini). Returns its path, or None if output is disabled."""
+    settings = settings if settings is not None else default_settings()
+    if not settings.allow_output:
+        return None
 
     print(f"Output is enabled!")
-    output_dir = config["OUTPUT"]["OutputFolderPath"]
+    output_dir = settings.output_folder_path
     if not (Path(output_dir).exists() and Path(output_dir).is_dir()):
         output_dir = (default_path) if default_path.is_dir() else (default_path.parent)
 
@@ -47,11 +97,9 @@ def make_output_folder(default_path):
 
     try:
         os.mkdir(output_dir)
-        os.mkdir(output_dir / 'diffs')
     except FileExistsError:
         print(f"Output directory already exists! Deleting..")
         shutil.rmtree(output_dir)
         os.mkdir(output_dir)
-        os.mkdir(output_dir / 'diffs')
-    OutputHandler.OUTPUT_FOLDER = output_dir
-    print(f"Output directory is: '{OutputHandler.OUTPUT_FOLDER}'")
+    print(f"Output directory is: '{output_dir}'")
+    return output_dir
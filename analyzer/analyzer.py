@@ -1,35 +1,53 @@
 import ast
+import threading
 from analyzer.utils import get_branches, load_patterns, flatten
-from analyzer import config
-from .utils import OutputHandler
+from analyzer import default_settings
+from logging import DEBUG, INFO
+from .utils import OutputHandler, Unparsed
+from .structural import structural_eq, remove_node
+from .registry import Recogniser
+from .stats import Rejection
 
 class Analyzer(ast.NodeVisitor):
-    Patterns = None
+    _registries = {}  # Mapping DiscoverPatterns to the PatternRegistry loaded with it, shared by every Analyzer of the process
+    _patterns_lock = threading.Lock()
 
     def recognise_Branch(self, branch):
         """Passes the branch to all known Patterns. Returns the pattern that recognises it. Returns None, if no pattern recognises the branch."""
-        for pattern in Analyzer.Patterns:
-            curr_pattern = pattern()
-            if curr_pattern.visit(branch.test):
-                return curr_pattern
-        return None
+        return self.recogniser.recognise(branch.test)
 
-    def log(self, text):
+    def log(self, level, msg, *args):
         if self.logger is not None:
-            self.logger.log(text)
+            self.logger.log(level, msg, *args)
 
-    def __init__(self):
+    def __init__(self, output_folder=None, settings=None, diagnostics=False):
+        self.settings = settings = settings if settings is not None else default_settings()
         self.branches = {} # Mapping If-nodes to a list of its branches. !!Only contains transformable if-nodes!!
         self.patterns = {} # Mapping branches to a pattern
         self.subjects = {} # Mapping the If-node to its selected subject !!Only contains transformable if-nodes!!
-        self.logger = OutputHandler("analyzer.log") if config["OUTPUT"].getboolean("AllowAnalyzerLogs") else None
+        self.logger = OutputHandler("analyzer.log", output_folder, settings.log_level, diagnostics) if settings.analyzer_logs or diagnostics else None
         self.file = "DEFAULT_FILENAME"
-        if Analyzer.Patterns is None:
-            Analyzer.Patterns = tuple(load_patterns())
-            for pattern in Analyzer.Patterns:
-                pattern.Patterns = Analyzer.Patterns
+        with Analyzer._patterns_lock: # Transformers might be created in several threads at once
+            patterns = Analyzer._registries.get(settings.discover_patterns)
+            if patterns is None:
+                patterns = load_patterns(settings.discover_patterns)
+                for pattern in patterns:
+                    pattern.Patterns = patterns
+                Analyzer._registries[settings.discover_patterns] = patterns
+        self.recogniser = Recogniser(patterns) # Caches the recognised patterns of every expression in the file
+        self.stats = self.recogniser.stats # Counters of the patterns, and the rejected If-nodes
+
+    def reset(self, file):
+        """Clears the per-file state, so the Analyzer can be reused for another file."""
+        self.branches = {}
+        self.patterns = {}
+        self.subjects = {}
+        self.file = file
+        self.recogniser.clear()
+        self.stats.files += 1
 
     def visit_If(self, node):
+        self.stats.if_nodes += 1
         self.branches[node] = get_branches(node)
 
         # Looping through the If-nodes branches
@@ -41,7 +59,8 @@ class Analyzer(ast.NodeVisitor):
             # Determine the main pattern of the branch
             branch_pattern = self.recognise_Branch(branch)
             if branch_pattern is None: # If no pattern recognises the branch, then delete the whole if node from the dict and return.
-                self.log(f"If-node in '{self.file}' at line ({node.test.lineno}) is not transformable: Branch ({ast.unparse(branch.test)}) is not recognisable!")
+                self.log(INFO, "If-node in '%s' at line (%d) is not transformable: Branch (%s) is not recognisable!", self.file, node.test.lineno, Unparsed(branch.test))
+                self.stats.reject(Rejection.NO_PATTERN)
                 del self.branches[node]
                 return
 
@@ -59,21 +78,22 @@ class Analyzer(ast.NodeVisitor):
 
 
         if len(potential_subjects) == 0: # No common subject across branches -> reject
-            self.log(f"If-node in '{self.file}' at line ({node.test.lineno}) is not transformable: No common subject is found!")
+            self.log(INFO, "If-node in '%s' at line (%d) is not transformable: No common subject is found!", self.file, node.test.lineno)
+            self.stats.reject(Rejection.NO_COMMON_SUBJECT)
             del self.branches[node]
             return
-        elif len(potential_subjects) > 1: # More than one common subjects across branches -> choose randomly
+        elif len(potential_subjects) > 1 and self.logger is not None and self.logger.enabled(DEBUG): # More than one common subjects across branches -> choose randomly
             subjects = set()
             for subj in potential_subjects:
                 subjects.add(ast.unparse(subj))
-            self.log(f"If-node in '{self.file}' at line ({node.test.lineno}) has more than one common subjects: {subjects}")
+            self.log(DEBUG, "If-node in '%s' at line (%d) has more than one common subjects: %s", self.file, node.test.lineno, subjects)
 
         self.subjects[node] = potential_subjects.pop()
 
         number_of_subBranches = 0
         for branch in self.branches[node]:
             # Checking nested If-nodes
-            subBranches = flatten(branch)
+            subBranches = flatten(branch, self.settings)
             if subBranches is not None: # Have to determine which version to transform: flattened, or base
                 isUgly = False
                 can_be_flattened = True
@@ -81,7 +101,7 @@ class Analyzer(ast.NodeVisitor):
                     pattern = self.recognise_Branch(subBranch) # NOT Guaranteed to be GuardPattern
                     if pattern is None:
                         can_be_flattened = False
-                        self.log(f"Branch in '{self.file}' at line ({branch.body[0].lineno-1}) cannot be flattened! No pattern recognises: ({ast.unparse(subBranch.test)})")
+                        self.log(DEBUG, "Branch in '%s' at line (%d) cannot be flattened! No pattern recognises: (%s)", self.file, branch.body[0].lineno - 1, Unparsed(subBranch.test))
                         break
 
                     self.patterns[subBranch] = pattern
@@ -95,29 +115,33 @@ class Analyzer(ast.NodeVisitor):
                         match subBranch.mainTest:
                             case ast.BoolOp(op = ast.And()):
                                 for term in subBranch.mainTest.values:
-                                    if term in temp:
-                                        temp.remove(term)
+                                    remove_node(temp, term)
                             case _:
-                                temp.remove(subBranch.mainTest)
+                                remove_node(temp, subBranch.mainTest)
 
-                        if temp == guardList: # Found ugly branch
-                            if not config["FLATTENING"].getboolean("AllowUglyFlattening"):
-                                self.log(f"Branch in '{self.file}' at line ({branch.body[0].lineno-1}) cannot be flattened! Would result in ugly subBranch: ({ast.unparse(subBranch.test)})")
+                        if structural_eq(temp, guardList): # Found ugly branch
+                            if not self.settings.allow_ugly_flattening:
+                                self.log(DEBUG, "Branch in '%s' at line (%d) cannot be flattened! Would result in ugly subBranch: (%s)", self.file, branch.body[0].lineno - 1, Unparsed(subBranch.test))
                             isUgly = True
 
-                if (not isUgly or config["FLATTENING"].getboolean("AllowUglyFlattening")) and can_be_flattened:
+                if (not isUgly or self.settings.allow_ugly_flattening) and can_be_flattened:
                     branch.flat = subBranches
                     number_of_subBranches += len(subBranches)
+                elif can_be_flattened:  # Only because of its ugly sub-branches
+                    self.stats.flattening_dropped += 1
 
             else:
-                self.log(f"Branch in '{self.file}' at line ({branch.body[0].lineno-1}) cannot be flattened!")
+                self.log(DEBUG, "Branch in '%s' at line (%d) cannot be flattened!", self.file, branch.body[0].lineno - 1)
         # print("-----\nnumber_of_subBranches", number_of_subBranches)
         # print("LEN self.branches[node]", len(self.branches[node]))
         # TODO config: minimum number of branches for an If-node to be transformed
-        if len(self.branches[node]) + number_of_subBranches < config["MAIN"].getint("MinimumBranches"):
-            self.log(f"If-node in '{self.file}' at line ({node.test.lineno}) does not have enough branches: ({len(self.branches[node]) + number_of_subBranches})")
+        if len(self.branches[node]) + number_of_subBranches < self.settings.minimum_branches:
+            self.log(INFO, "If-node in '%s' at line (%d) does not have enough branches: (%d)", self.file, node.test.lineno, len(self.branches[node]) + number_of_subBranches)
+            self.stats.reject(Rejection.TOO_FEW_BRANCHES)
             del self.branches[node]
             del self.subjects[node]
+        else:
+            self.stats.transformable += 1
 
 
 
@@ -0,0 +1,144 @@
+import os
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from analyzer import default_settings
+from .utils import atomic_write
+
+# Config sections, that change the result of a transformation
+_FINGERPRINT_SECTIONS = ("MAIN", "FLATTENING")
+_TMP_PREFIX = ".tmp-"  # Prefix of the temporary files of atomic_write
+_STALE_TMP_SECONDS = 3600
+
+
+@lru_cache(maxsize=1)
+def _code_digest():
+    import hashlib  # hashlib and json are only imported, when the cache is used
+    digest = hashlib.sha256()
+    package = Path(__file__).parent
+    for source in sorted(package.glob("*.py")) + sorted((package / "patterns").glob("*.py")):
+        digest.update(source.name.encode())
+        digest.update(source.read_bytes())
+    return digest.digest()
+
+
+@lru_cache(maxsize=8)
+def fingerprint(settings):
+    """
+    Returns a digest of everything besides the source file, that the result of a transformation depends on:
+    the relevant options of the settings, and the code of the analyzer and its pattern plugins.
+    """
+    import hashlib
+    digest = hashlib.sha256()
+    for section in _FINGERPRINT_SECTIONS:
+        for key, value in settings.section(section):
+            digest.update(f"[{section}]{key}={value}\n".encode())
+    digest.update(_code_digest())
+    return digest.digest()
+
+
+def default_cache_folder():
+    base = os.environ.get("XDG_CACHE_HOME") or (Path.home() / ".cache")
+    return Path(base) / "transpy"
+
+
+class ResultCache:
+    """
+    Content-addressed, on-disk cache of transformation results.
+    Every entry is a separate json file, named after the hash of the source file and the fingerprint().
+    Entries are written to a temporary file first, and renamed into place, so concurrent workers never see partial entries.
+    """
+
+    def __init__(self, folder, max_size, settings=None):
+        self.folder = Path(folder)
+        self.max_size = max_size  # In bytes, 0 means unbounded
+        self.fingerprint = fingerprint(settings if settings is not None else default_settings())
+
+    @classmethod
+    def from_config(cls, settings=None):
+        """Returns a ResultCache based on the settings (default: config.ini), or None if caching is disabled."""
+        settings = settings if settings is not None else default_settings()
+        if not settings.allow_cache:
+            return None
+        folder = settings.cache_folder
+        if folder == "Default":
+            folder = default_cache_folder()
+        return cls(folder, settings.max_cache_size_MiB * 1048576, settings)
+
+    def key(self, data):
+        """Returns the key of the entry for a source file, with the given content in bytes."""
+        import hashlib
+        return hashlib.sha256(self.fingerprint + data).hexdigest()
+
+    def _path(self, key):
+        return self.folder / key[:2] / f"{key}.json"
+
+    def get(self, key):
+        """Returns the cached entry, or None if there is none."""
+        import json
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            # Marking the entry as recently used for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, entry):
+        import json
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write(path, json.dumps(entry).encode("utf-8"))
+        except OSError:
+            # The cache is just an optimization, failing to write it is not an error
+            pass
+
+    def evict(self):
+        """Deletes the least recently used entries, until the size of the cache is under max_size. Returns the number of deleted entries."""
+        if not self.folder.is_dir():
+            return 0
+        entries = []
+        size = 0
+        now = time.time()
+        for sub in os.scandir(self.folder):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith(_TMP_PREFIX):
+                    # Left behind by a crashed worker
+                    if now - stat.st_mtime > _STALE_TMP_SECONDS:
+                        _unlink(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                size += stat.st_size
+
+        if not self.max_size or size <= self.max_size:
+            return 0
+        deleted = 0
+        entries.sort()
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            # Other processes might be evicting at the same time
+            _unlink(path)
+            size -= entry_size
+            deleted += 1
+        return deleted
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
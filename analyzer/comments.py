@@ -0,0 +1,43 @@
+import tokenize
+
+
+class CommentIndex:
+    """
+    Comments and empty lines of a source file, indexed by their line number (1-based).
+    full[n]: the comment taking up the whole line n, or None
+    inline[n]: the comment at the end of line n, after some code, or None
+    blank[n]: True, if line n is empty (or only whitespace)
+    """
+    __slots__ = ("full", "inline", "blank")
+
+    def __init__(self, line_count):
+        self.full = [None] * (line_count + 2)
+        self.inline = [None] * (line_count + 2)
+        self.blank = [False] * (line_count + 2)
+
+    @classmethod
+    def from_tokens(cls, tokens, src_lines):
+        index = cls(len(src_lines))
+        cyclestart = True  # True at the start of each line
+        for token in tokens:
+            if token.type == tokenize.COMMENT:
+                if cyclestart:
+                    index.full[token.start[0]] = token.string
+                else:
+                    index.inline[token.start[0]] = token.string
+                cyclestart = False
+            else:
+                cyclestart = token.string == "\n"
+        for i, row in enumerate(src_lines):
+            if row.replace(" ", "").replace("\t", "") == "\n":
+                index.blank[i + 1] = True
+        return index
+
+    def full_comment(self, row):
+        return self.full[row] if 0 <= row < len(self.full) else None
+
+    def inline_comment(self, row):
+        return self.inline[row] if 0 <= row < len(self.inline) else None
+
+    def is_blank(self, row):
+        return 0 <= row < len(self.blank) and self.blank[row]
@@ -0,0 +1,257 @@
+"""
+Long-running daemon for editors and bots: keeps warm Transformers, and answers requests of a line-delimited JSON protocol,
+read from stdin (answered on stdout) or from the connections of a Unix socket.
+
+Every request is a JSON object on one line:
+    {"id": 1, "source": "...", "path": "a.py", "line_ranges": [[10, 20]], "options": {"MinimumBranches": 2},
+     "write": false, "text": true, "diff": true}
+    - id: anything, echoed in the response. Responses are written as they complete, not necessarily in the order of the requests.
+    - source: the source code to transform, or path: the python file to read (source takes precedence, path then only names it).
+    - line_ranges: only transform the If-nodes overlapping these (first, last) line ranges.
+    - options: overrides of config.ini options for this request (see Settings.with_options()).
+    - write: with a path, write the transformed file back in place (if it changed, and is valid python).
+    - text / diff: whether to return the transformed text / the unified diff of the file (default: both).
+    {"command": "ping"} is answered with {"ok": true}, {"command": "shutdown"} stops the daemon.
+
+Every response is a JSON object on one line:
+    {"id": 1, "ok": true, "changed": true, "text": "...", "diff": "...", "written": false, "skipped": false, "visited_nodes": 3,
+     "nodes": [{"lineno": 2, "end_lineno": 9, "subject": "x"}], "diagnostics": [{"level": "INFO", "message": "..."}], "elapsed_ms": 1.2}
+    or {"id": 1, "ok": false, "error": {"type": "SyntaxError", "message": "...", "lineno": 3}, "diagnostics": [...]}
+Text, and the diff use the newlines of the source.
+"""
+import ast
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from analyzer import Transformer, default_settings
+from .patch import file_header
+
+_worker = threading.local()  # The Transformers of the worker process (or thread), by their Settings
+
+# The Transformers kept by a worker: the least recently used one goes, when a request overrides the options in yet another way
+MAX_TRANSFORMERS = 8
+
+
+def init_daemon_worker(settings=None):
+    """Initializer of the daemon's workers: creates the Transformer of the default settings, so the first request is fast too."""
+    _worker.settings = settings if settings is not None else default_settings()
+    _worker.transformers = OrderedDict()
+    _transformer(_worker.settings)
+
+
+def _transformer(settings):
+    transformers = _worker.transformers
+    tr = transformers.get(settings)
+    if tr is None:
+        tr = transformers[settings] = Transformer(settings=settings, diagnostics=True)
+        if len(transformers) > MAX_TRANSFORMERS:
+            transformers.popitem(last=False)
+    else:
+        transformers.move_to_end(settings)
+    return tr
+
+
+def _options(options):
+    # JSON scalars to the strings of config.ini
+    for name, value in options.items():
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        yield name, str(value)
+
+
+def _error(request_id, error, diagnostics=()):
+    info = {"type": type(error).__name__, "message": getattr(error, "msg", None) or str(error)}
+    if isinstance(error, SyntaxError):
+        info["lineno"] = error.lineno
+    return {"id": request_id, "ok": False, "error": info, "diagnostics": list(diagnostics)}
+
+
+def _diagnostics(tr):
+    return [{"level": logging.getLevelName(level), "message": message} for _, _, level, message in tr.drain_logs()]
+
+
+def _diff_path(path):
+    # Relative to the working directory of the daemon, when inside it, like the patches of the CLI are relative to the project
+    if path is None:
+        return "<string>"
+    relative = os.path.relpath(path)
+    return relative if not relative.startswith("..") else path.lstrip("/")
+
+
+def handle(request):
+    """Answers a transform request (see the module's docstring). Runs in the workers, returns the response as a dict."""
+    if getattr(_worker, "settings", None) is None:  # Called outside of the workers
+        init_daemon_worker()
+    try:
+        return _handle(request)
+    finally:
+        # The records of a request, that failed with an unexpected error, must not show up in the response of the next one
+        for tr in _worker.transformers.values():
+            tr.drain_logs()
+
+
+def _handle(request):
+    start = time.perf_counter()
+    request_id = request.get("id")
+    settings = _worker.settings
+    try:
+        if request.get("options"):
+            settings = settings.with_options(_options(request["options"]))
+        tr = _transformer(settings)
+        path = request.get("path")
+        line_ranges = [tuple(r) for r in request["line_ranges"]] if request.get("line_ranges") is not None else None
+        if request.get("source") is not None:
+            data = None
+            result = tr.transform_source(request["source"], line_ranges, filename=path or "<string>")
+        elif path is not None:
+            with open(path, "rb") as f:
+                data = f.read()
+            result = tr.transform_bytes(data, line_ranges, filename=path)
+        else:
+            raise ValueError("A request needs a 'source' or a 'path'")
+    except (OSError, SyntaxError, UnicodeDecodeError, ValueError, TypeError) as error:
+        tr = _worker.transformers.get(settings)
+        return _error(request_id, error, _diagnostics(tr) if tr is not None else ())
+
+    changed = result.changed
+    if changed:
+        try:
+            ast.parse(result.text)
+        except SyntaxError as error:
+            tr.log(logging.ERROR, "NOT TRANSFORMING %s: SyntaxError: %s - line(%s)", path or "<string>", error.msg, error.lineno)
+            changed = False
+
+    written = False
+    if changed and request.get("write") and data is not None:
+        try:
+            written = tr.write_results(path, data, result, validate=False)  # Validated above
+        except OSError as error:
+            return _error(request_id, error, _diagnostics(tr))
+
+    response = {"id": request_id, "ok": True, "changed": changed, "written": written, "skipped": tr.skipped,
+                "visited_nodes": result.visited_nodes,
+                "nodes": [{"lineno": node.lineno, "end_lineno": node.end_lineno, "subject": node.subject} for node in result.nodes] if changed else []}
+    if request.get("text", True):
+        text = result.text if changed else tr.source.text
+        response["text"] = text.replace("\n", result.newline) if result.newline != "\n" else text
+    if request.get("diff", True):
+        hunks = result.diff(newline=result.newline) if changed else ""
+        response["diff"] = file_header(_diff_path(path)) + hunks if hunks else ""
+    response["diagnostics"] = _diagnostics(tr)
+    response["elapsed_ms"] = (time.perf_counter() - start) * 1000
+    return response
+
+
+class Daemon:
+    """
+    Serves the requests of the protocol with a pool of warm workers: threads of this interpreter (lowest latency),
+    or processes (for serving several clients in parallel).
+    """
+
+    def __init__(self, settings=None, jobs=1, backend="threads"):
+        import concurrent.futures
+        if backend == "threads":
+            self.executor = concurrent.futures.ThreadPoolExecutor(jobs, initializer=init_daemon_worker, initargs=(settings,))
+        else:
+            self.executor = concurrent.futures.ProcessPoolExecutor(jobs, initializer=init_daemon_worker, initargs=(settings,))
+        self.stopped = threading.Event()
+        # Starting every worker now, not on the first requests
+        for future in [self.executor.submit(time.sleep, 0.01) for _ in range(jobs)]:
+            future.result()
+
+    def serve(self, infile, outfile):
+        """
+        Reads the requests line by line from the binary file infile, until its end, or a shutdown request.
+        The responses are written to the binary file outfile, as they complete. Returns after every response has been written.
+        """
+        lock = threading.Lock()  # Of writing outfile
+        finished = threading.Condition()
+        pending = 0  # Requests without a response yet
+
+        def respond(response):
+            line = json.dumps(response).encode("utf-8") + b"\n"
+            with lock:
+                outfile.write(line)
+                outfile.flush()
+
+        def done(future, request_id):
+            nonlocal pending
+            try:
+                response = future.result()
+            except Exception as error:  # The worker died, or the response could not be pickled
+                response = _error(request_id, error)
+            try:
+                respond(response)
+            except (OSError, ValueError):  # The client went away
+                pass
+            with finished:
+                pending -= 1
+                finished.notify_all()
+
+        for line in infile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("A request has to be a JSON object")
+            except ValueError as error:
+                respond(_error(None, error))
+                continue
+            command = request.get("command", "transform")
+            if command == "shutdown":
+                self.stopped.set()
+                break
+            if command == "ping":
+                respond({"id": request.get("id"), "ok": True})
+                continue
+            if command != "transform":
+                respond(_error(request.get("id"), ValueError(f"Unknown command: {command}")))
+                continue
+            with finished:
+                pending += 1
+            future = self.executor.submit(handle, request)
+            future.add_done_callback(lambda f, request_id=request.get("id"): done(f, request_id))
+
+        with finished:
+            finished.wait_for(lambda: pending == 0)
+
+    def serve_stdio(self):
+        """Serves stdin and stdout. Anything else printed gets redirected to stderr, so it doesn't break the protocol."""
+        import sys
+        stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+        sys.stdout = sys.stderr
+        self.serve(stdin, stdout)
+
+    def serve_socket(self, path):
+        """Serves every connection of the Unix socket at path in a thread of its own, until a shutdown request."""
+        import socketserver
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon.serve(self.rfile, self.wfile)
+                if daemon.stopped.is_set():
+                    threading.Thread(target=server.shutdown, daemon=True).start()
+
+        if os.path.exists(path):
+            os.unlink(path)  # Left behind by an earlier daemon
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+            server.daemon_threads = True
+            try:
+                server.serve_forever()
+            finally:
+                os.unlink(path)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
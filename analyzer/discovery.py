@@ -0,0 +1,164 @@
+import os
+import re
+from fnmatch import fnmatch
+
+
+def _translate(pattern):
+    """Translates a .gitignore glob (without the leading '!', and trailing '/') into a regex, matching paths relative to the .gitignore."""
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    i, n = 0, len(pattern)
+    regex = "" if anchored else "(?:.*/)?"
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == n:
+            regex += "/.*"
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                regex += f"[{body}]"
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return re.compile(regex + r"\Z")
+
+
+class IgnoreRules:
+    """
+    The rules of a .gitignore file, matching paths relative to the folder of the file.
+    Supports what is used in practice: negation, folder-only rules, anchoring, '*', '?', '**' and character classes.
+    """
+
+    def __init__(self, lines):
+        self.rules = []  # (regex, negated, folders only) tuples
+        for line in lines:
+            line = line.rstrip("\n").rstrip("\r")
+            if not line.strip() or line.startswith("#"):
+                continue
+            if not line.endswith("\\ "):
+                line = line.rstrip()
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if line:
+                self.rules.append((_translate(line), negated, dir_only))
+
+    @classmethod
+    def from_file(cls, path):
+        """Returns the rules of the file, or None if there is no such file."""
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                return cls(f.readlines())
+        except OSError:
+            return None
+
+    def match(self, rel_path, is_dir):
+        """Returns True if the path is ignored, False if it is explicitly re-included, None if no rule matches it."""
+        for regex, negated, dir_only in reversed(self.rules):  # The last matching rule wins
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negated
+        return None
+
+
+def _repository_rules(root):
+    """Returns the (folder, IgnoreRules) pairs applying to root from outside of it: the .gitignore files of the parent folders up to the repository root, and .git/info/exclude."""
+    parents = []
+    folder = root
+    while True:
+        parents.append(folder)
+        if os.path.exists(os.path.join(folder, ".git")):
+            break
+        parent = os.path.dirname(folder)
+        if parent == folder:  # Not inside a repository
+            return []
+        folder = parent
+
+    result = []
+    info = IgnoreRules.from_file(os.path.join(parents[-1], ".git", "info", "exclude"))
+    if info is not None:
+        result.append((parents[-1], info))
+    for folder in reversed(parents[1:]):
+        rules = IgnoreRules.from_file(os.path.join(folder, ".gitignore"))
+        if rules is not None:
+            result.append((folder, rules))
+    return result
+
+
+def _ignored(rules, path, is_dir):
+    # Deeper .gitignore files take precedence
+    for folder, ignore in reversed(rules):
+        decision = ignore.match(os.path.relpath(path, folder).replace(os.sep, "/"), is_dir)
+        if decision is not None:
+            return decision
+    return False
+
+
+def discover(root, excludes=(), use_gitignore=True, suffix=".py"):
+    """
+    Yields the (path, size in bytes) of the python files under root, as they are found, walking the tree with os.scandir.
+    excludes: globs, matched against the names and the paths (relative to root) of files and folders. Matching folders are not entered.
+    use_gitignore: skip what the .gitignore files (of root, its subfolders, and its parent folders inside the repository) ignore.
+    Folders are visited depth-first in name order, symlinked folders are not followed. '.git' folders are always skipped.
+    """
+    root = os.path.abspath(root)
+
+    def excluded(name, rel):
+        return any(fnmatch(name, glob) or fnmatch(rel, glob) for glob in excludes)
+
+    base_rules = _repository_rules(root) if use_gitignore else []
+    stack = [(root, base_rules)]
+    while stack:
+        folder, rules = stack.pop()
+        if use_gitignore:
+            own = IgnoreRules.from_file(os.path.join(folder, ".gitignore"))
+            if own is not None:
+                rules = rules + [(folder, own)]
+        try:
+            with os.scandir(folder) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            continue
+        subfolders = []
+        for entry in entries:
+            rel = os.path.relpath(entry.path, root).replace(os.sep, "/")
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if is_dir:
+                    if entry.name == ".git" or excluded(entry.name, rel) or (rules and _ignored(rules, entry.path, True)):
+                        continue
+                    subfolders.append(entry.path)
+                elif entry.name.endswith(suffix) and entry.is_file():
+                    if excluded(entry.name, rel) or (rules and _ignored(rules, entry.path, False)):
+                        continue
+                    yield entry.path, entry.stat().st_size
+            except OSError:
+                continue
+        # Reversed, so the stack pops them in name order
+        stack.extend((sub, rules) for sub in reversed(subfolders))
@@ -0,0 +1,91 @@
+import os
+import shutil
+import stat
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl request of Linux, making dst share the data blocks of src (copy-on-write filesystems only: btrfs, xfs, ...)
+_FICLONE = 0x40049409
+
+MODES = ("reflink", "copy", "hardlink", "skip")
+
+# Folders never mirrored into the output tree
+EXCLUDED_FOLDERS = frozenset(("transpy-output", "__pycache__"))
+
+
+def _clone(src, dst, reflink):
+    """Creates dst with the content of src. Raises FileExistsError, if dst already exists."""
+    with open(src, "rb") as fsrc:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+        with os.fdopen(fd, "wb") as fdst:
+            try:
+                if not reflink or fcntl is None:
+                    raise OSError
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            except OSError:
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+            fdst.flush()
+            # Through the fd, not the path: a worker may have already replaced dst with the transformed file
+            st = os.fstat(fsrc.fileno())
+            if os.utime in os.supports_fd:
+                os.utime(fdst.fileno(), ns=(st.st_atime_ns, st.st_mtime_ns))
+            if os.chmod in os.supports_fd:
+                os.chmod(fdst.fileno(), stat.S_IMODE(st.st_mode))
+
+
+def place_file(src, dst, mode):
+    """
+    Places the unchanged file src at dst, based on mode:
+        reflink: a copy-on-write clone, falling back to a copy if the filesystem cannot do it
+        copy: a copy
+        hardlink: a hard link (falling back to a copy across filesystems). Editing it edits the original too!
+        skip: nothing
+    Symlinks are recreated as symlinks. Files already at dst (written by the transformation) are never overwritten.
+    Returns True, if the file was placed.
+    """
+    if mode == "skip":
+        return False
+    try:
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+        elif mode == "hardlink":
+            try:
+                os.link(src, dst)
+            except FileExistsError:
+                raise
+            except OSError:
+                _clone(src, dst, reflink=False)
+        else:
+            _clone(src, dst, reflink=mode == "reflink")
+    except FileExistsError:
+        return False
+    return True
+
+
+def mirror_tree(src, dst, mode, excluded=EXCLUDED_FOLDERS):
+    """
+    Mirrors the folder src into dst, placing every file with place_file(). Runs alongside the transformation:
+    files are only ever created exclusively, so the ones already written by it are left alone, and the ones
+    written after are atomically replaced by it. Returns the number of placed files.
+    """
+    if mode == "skip":
+        return 0
+    placed = 0
+    for root, dirs, files in os.walk(src):
+        dirs[:] = [d for d in dirs if d not in excluded]
+        target = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target, exist_ok=True)
+        for d in dirs:
+            path = os.path.join(root, d)
+            if os.path.islink(path):
+                # os.walk doesn't descend into symlinked folders, recreating the link
+                place_file(path, os.path.join(target, d), mode)
+        for name in files:
+            try:
+                placed += place_file(os.path.join(root, name), os.path.join(target, name), mode)
+            except OSError as error:
+                print(f"Cannot place '{os.path.join(root, name)}': {error}")
+    return placed
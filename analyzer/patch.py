@@ -0,0 +1,114 @@
+import os
+
+_NO_NEWLINE = "\\ No newline at end of file\n"
+
+
+def outermost(results):
+    """
+    Yields the (start row, end row, new lines) of the transformed If-nodes in results, in order (rows are 0-based, end is exclusive).
+    Nodes nested inside an already yielded node are skipped, the outer node's new lines contain them.
+    """
+    pos = 0
+    for start in sorted(results):
+        if start < pos:
+            continue
+        lines, end = results[start][:2]
+        yield start, end, lines
+        pos = end
+
+
+def unified_hunks(src_lines, results, context=3, newline="\n"):
+    """
+    Returns the hunks of the unified diff between the source lines, and the source with the results spliced in (see splice()).
+    Only the replaced spans, and the context lines around them are looked at, the rest of the file is never compared.
+    newline: the line ending of the diffed lines. The lines of the patch itself always end with "\n", like git's,
+        so with CR-only line endings, the whole file is a single line (one hunk replacing it), that git apply and patch accept.
+    """
+    def _line(prefix, line):
+        if line.endswith("\n"):
+            return prefix + line[:-1] + newline
+        return prefix + line + "\n" + _NO_NEWLINE
+
+    changes = []
+    for start, end, lines in outermost(results):
+        line = src_lines[start]
+        indent = line[:len(line) - len(line.lstrip())]
+        # A new line might hold several physical lines (comments, and newlines get inserted into them)
+        changes.append((start, end, "".join(indent + newLine for newLine in lines).splitlines(keepends=True)))
+
+    if newline == "\r":
+        new_lines, pos = [], 0
+        for start, end, lines in changes:
+            new_lines.extend(src_lines[pos:start])
+            new_lines.extend(lines)
+            pos = end
+        new_lines.extend(src_lines[pos:])
+        old, new = "".join(src_lines).replace("\n", "\r"), "".join(new_lines).replace("\n", "\r")
+        return f"@@ -1 +1 @@\n-{old}\n{_NO_NEWLINE}+{new}\n{_NO_NEWLINE}" if changes else ""
+
+    # Changes closer to each other than their context get into the same hunk
+    groups = []
+    for change in changes:
+        if groups and change[0] - groups[-1][-1][1] <= 2 * context:
+            groups[-1].append(change)
+        else:
+            groups.append([change])
+
+    hunks = []
+    offset = 0  # The number of lines the new file is longer than the old one, before the current hunk
+    for group in groups:
+        old_start = max(0, group[0][0] - context)
+        old_end = min(len(src_lines), group[-1][1] + context)
+        body = []
+        pos = old_start
+        new_length = 0
+        for start, end, new_lines in group:
+            body.extend(_line(" ", line) for line in src_lines[pos:start])
+            body.extend(_line("-", line) for line in src_lines[start:end])
+            body.extend(_line("+", line) for line in new_lines)
+            new_length += (start - pos) + len(new_lines)
+            pos = end
+        body.extend(_line(" ", line) for line in src_lines[pos:old_end])
+        new_length += old_end - pos
+        old_length = old_end - old_start
+        hunks.append(f"@@ -{old_start + 1},{old_length} +{old_start + offset + 1},{new_length} @@\n")
+        hunks.extend(body)
+        offset += new_length - old_length
+    return "".join(hunks)
+
+
+def file_header(path):
+    """Returns the header of a file's diff in a git style patch. path: the path of the file relative to the root of the patch."""
+    path = str(path).replace("\\", "/")
+    return f"diff --git a/{path} b/{path}\n--- a/{path}\n+++ b/{path}\n"
+
+
+class PatchWriter:
+    """
+    Streams the diffs of the transformed files into one git style patch (diffs.diff in the output folder), run by the main process.
+    Paths are relative to the given project folder, the patch applies to the original files with 'git apply' (or 'patch -p1').
+    """
+
+    def __init__(self, output_folder, filename="diffs.diff"):
+        self.path = os.path.join(output_folder, filename) if output_folder is not None else None
+        self._out = None
+
+    def write(self, path, hunks):
+        """path: the path of the file relative to the project folder. hunks: the encoded hunks of its diff."""
+        if self.path is None or not hunks:
+            return
+        if self._out is None:
+            self._out = open(self.path, "wb")
+        self._out.write(file_header(path).encode("utf-8"))
+        self._out.write(hunks)
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
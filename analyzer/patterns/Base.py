@@ -10,8 +10,13 @@ class PatternBase(metaclass=abc.ABCMeta):
     - transform(node): returns an ast pattern, that can be used inside an ast.match_case 
     - guard(subjectNode): Returns an expression, to put in guard. Can be different based on chosen subjectNode.
     - potential_subjects(): returns a set, containing nodes that the pattern recognises as a subject node. (subjects are used for ast.Match)
+      Should be an analyzer.structural.NodeSet, so structurally equal nodes count as the same subject.
     Every instance of a pattern should initialize a node attribute, that stores what node its visit method was called on originally.
-    Every valid pattern class gets a static attribute 'Patterns', which is a tuple of all valid Pattern classes. This can be used to recognise sub-patterns.
+    Every valid pattern class gets a static attribute 'Patterns', which is a tuple of all valid Pattern classes (an analyzer.registry.PatternRegistry).
+    This can be used to recognise sub-patterns, with Patterns.recognise(node) and Patterns.recognises(node, subject).
+    Instances created by the analyzer get an instance attribute 'Patterns' instead, which caches these results for the file, so use self.Patterns.
+    A pattern can declare the ast node types it is able to recognise in a static tuple attribute, 'NodeTypes'.
+    The pattern is then only tried on nodes of these types. Patterns without 'NodeTypes' are tried on every node.
     Some patterns might require some back-tracking, to properly work: 
     Every pattern should have a static boolean attribute, 'IsComplex' indicating this.
     If the pattern is complex, the pattern has to provide a method "process(parentPattern)", which the parent Pattern should call, passing itself.
@@ -1,13 +1,15 @@
 import ast
+from analyzer.structural import NodeSet, structural_eq
 
 
 def is_attribute_of(attr, node):
-    return (isinstance(attr, ast.Attribute) and attr.value == node)
+    return (isinstance(attr, ast.Attribute) and structural_eq(attr.value, node))
 
 class ClassPattern:
     IsComplex = True
+    NodeTypes = (ast.Call,)
     def __init__(self):
-        self._potential_subjects = set()
+        self._potential_subjects = NodeSet()
         self.className = None
         self.kwd_attribtues = []
         self.kwd_patterns = []
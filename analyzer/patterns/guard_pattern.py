@@ -1,11 +1,13 @@
 import ast
+from analyzer.structural import NodeSet
 
 class GuardPattern():
     IsComplex = False
+    NodeTypes = (ast.BoolOp,)
     def __init__(self):
         self.terms = []
         self._guard = []
-        self._potential_subjects = set()
+        self._potential_subjects = NodeSet()
         self.node = None
 
     def visit(self, node):
@@ -18,13 +20,11 @@ class GuardPattern():
             return False
             
         for value in node.values:
-            for pattern in GuardPattern.Patterns:
-                curr_pattern = pattern()
-                if curr_pattern.visit(value):
-                    self.terms.append(curr_pattern)
-                    #print(f"PATTERN: ({ast.unparse(value)}) RECOGNISED BY: {type(curr_pattern).__name__}")
-                    break
-            
+            curr_pattern = self.Patterns.recognise(value)
+            if curr_pattern is not None:
+                self.terms.append(curr_pattern)
+                #print(f"PATTERN: ({ast.unparse(value)}) RECOGNISED BY: {type(curr_pattern).__name__}")
+
             self._guard.append(value)
 
         if len(self.terms) == 0:
@@ -75,13 +75,7 @@ class GuardPattern():
             return None
         res = []
         for term in self._guard:
-            recognised = False
-            for pattern in GuardPattern.Patterns:
-                curr_pattern = pattern()
-                if (curr_pattern.visit(term)) and (subject in curr_pattern.potential_subjects()):
-                    recognised = True
-                    break
-            if not recognised:
+            if not self.Patterns.recognises(term, subject):
                 res.append(term)
         if len(res):
             return ast.BoolOp(op = ast.And(), values = res)
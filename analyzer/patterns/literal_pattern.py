@@ -1,11 +1,13 @@
 import ast
+from analyzer.structural import NodeSet, structural_eq
 
 
 class LiteralPattern:
     IsComplex = False
+    NodeTypes = (ast.Compare,)
     
     def __init__(self):
-        self._potential_subjects = set()
+        self._potential_subjects = NodeSet()
         self.const_node = None
         self.node = None
         self.singleton = False
@@ -31,7 +33,7 @@ class LiteralPattern:
     def transform(self, subject):
         for subject_node in self._potential_subjects:
             break
-        if not subject == subject_node:
+        if not structural_eq(subject, subject_node):
             raise ValueError(f"Cannot transform LiteralPattern! Given subject: {subject}, Expected: {subject_node}")
         if self.singleton:
             return ast.MatchSingleton(self.const_node.value)
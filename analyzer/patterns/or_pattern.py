@@ -1,10 +1,12 @@
 import ast
+from analyzer.structural import NodeSet
 
 class OrPattern():
     IsComplex = False
+    NodeTypes = (ast.BoolOp,)
     def __init__(self):
         self.terms = []
-        self._potential_subjects = set()
+        self._potential_subjects = NodeSet()
         self.node = None
 
     def visit(self, node):
@@ -15,13 +17,11 @@ class OrPattern():
             return False
 
         for value in node.values:
-            for pattern in OrPattern.Patterns:
-                curr_pattern = pattern()
-                if curr_pattern.visit(value):
-                    self.terms.append(curr_pattern)
-                    #print(f"PATTERN: ({ast.unparse(value)}) RECOGNISED BY: {type(curr_pattern).__name__}")
-                    break
-                
+            curr_pattern = self.Patterns.recognise(value)
+            if curr_pattern is not None:
+                self.terms.append(curr_pattern)
+                #print(f"PATTERN: ({ast.unparse(value)}) RECOGNISED BY: {type(curr_pattern).__name__}")
+
         if len(node.values) != len(self.terms):
             return False
         # At this point, every term is a recognised pattern
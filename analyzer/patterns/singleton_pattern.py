@@ -1,10 +1,12 @@
 import ast
+from analyzer.structural import NodeSet, structural_eq
 
 
 class SingletonPattern:
     IsComplex = True
+    NodeTypes = (ast.Compare,)
     def __init__(self):
-        self._potential_subjects = set()
+        self._potential_subjects = NodeSet()
         self.const_node = None
         self.node = None
         self.inverted = False
@@ -27,7 +29,7 @@ class SingletonPattern:
         for subject_node in self._potential_subjects:
             break
 
-        if not subject == subject_node:
+        if not structural_eq(subject, subject_node):
             raise ValueError(f"Cannot transform SingletonPattern! Given subject: {subject}, Expected: {subject_node}")
 
         if len(self._guard):
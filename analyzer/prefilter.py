@@ -0,0 +1,32 @@
+import re
+from itertools import islice
+
+# Keywords inside strings and comments get counted too, which can only make the check more permissive.
+_IF = re.compile(rb"\bif\b")
+_BRANCH = re.compile(rb"\b(?:if|elif|else)\b")
+_TEST = re.compile(rb"==|\bis\b|\bisinstance\b")
+
+
+def _has_at_least(regex, data, n):
+    return n <= 0 or sum(1 for _ in islice(regex.finditer(data), n)) == n
+
+
+def might_transform(data, minimum_branches, allow_flattening):
+    """
+    Cheap check on the raw bytes of a source file, whether it can contain an If-node with enough branches to be transformed.
+    Returns False only, if the file surely has no such If-node.
+    An else with a nested If-node in it is a branch just like an elif, so the chain can have no elif at all:
+    >>> might_transform(b"if x == 1:\\n    a()\\nelse:\\n    if x == 2:\\n        b()\\n    else:\\n        c()\\n", 3, False)
+    True
+    """
+    if not _IF.search(data):
+        return False
+
+    if allow_flattening:
+        # Every branch, flattened or not, is a separate if/elif/else keyword,
+        # but flattened branches can share the same recognised test.
+        return _has_at_least(_BRANCH, data, minimum_branches) and _has_at_least(_TEST, data, 1)
+
+    # Every branch of a chain of n branches has its own if/elif/else keyword, and every branch, except the else, has a recognised test
+    return (_has_at_least(_BRANCH, data, minimum_branches) and
+            _has_at_least(_TEST, data, max(minimum_branches - 1, 1)))
@@ -0,0 +1,126 @@
+import time
+from contextlib import nullcontext
+
+# The phases of transforming a file, in order
+PHASES = ("read", "prefilter", "cache", "parse", "visit", "analyze", "build", "tokenize", "unparse", "splice", "validate", "write", "diff")
+
+_NULL = nullcontext()
+
+
+class _Phase:
+    __slots__ = ("profiler", "name")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._push(self.name)
+
+    def __exit__(self, *exc_info):
+        self.profiler._pop()
+
+
+class Profiler:
+    """
+    Measures the wall and CPU time spent in each phase of transforming a file. Phases nest, the time of a phase is exclusive:
+    the time spent in the phases nested inside it is only counted for those. CPU time is the time of the current thread.
+    With memory=True, the peak of the memory allocated by python during each file is measured too, with tracemalloc.
+    Tracing slows down every allocation, so the times measured with memory=True are inflated, most of all in the allocating phases.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self._stack = []  # [name, wall at start or resume, cpu at start or resume] of the open phases
+        self.file = None
+
+    def start_file(self, file):
+        self.file = {"file": str(file), "wall_s": 0.0, "cpu_s": 0.0, "peak_memory_KiB": None, "phases": {}}
+        self._file_start = (time.perf_counter(), time.thread_time())
+        if self.memory:
+            import tracemalloc  # Only imported when measuring the memory
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._memory_start = tracemalloc.get_traced_memory()[0]
+
+    def end_file(self):
+        """Returns the profile of the file as a dict: its total, and per-phase wall and CPU times, and its peak memory."""
+        while self._stack:
+            self._pop()
+        record = self.file
+        wall, cpu = self._file_start
+        record["wall_s"] = time.perf_counter() - wall
+        record["cpu_s"] = time.thread_time() - cpu
+        if self.memory:
+            import tracemalloc
+            record["peak_memory_KiB"] = (tracemalloc.get_traced_memory()[1] - self._memory_start) / 1024
+        self.file = None
+        return record
+
+    def phase(self, name):
+        """Returns a context manager measuring the phase."""
+        return _Phase(self, name) if self.file is not None else _NULL
+
+    def _add(self, entry, wall, cpu):
+        times = self.file["phases"].setdefault(entry[0], [0.0, 0.0])
+        times[0] += wall - entry[1]
+        times[1] += cpu - entry[2]
+
+    def _push(self, name):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        if self._stack:
+            # Pausing the enclosing phase
+            self._add(self._stack[-1], wall, cpu)
+        self._stack.append([name, wall, cpu])
+
+    def _pop(self):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        self._add(self._stack.pop(), wall, cpu)
+        if self._stack:
+            # Resuming the enclosing phase
+            self._stack[-1][1] = wall
+            self._stack[-1][2] = cpu
+
+
+class ProfileReport:
+    """Aggregates the file profiles coming from the workers in the main process."""
+
+    def __init__(self, slowest=20):
+        self.slowest = slowest
+        self.files = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.phases = {}
+        self.peak_memory_KiB = None  # Only measured with Profiler(memory=True)
+        self._records = []  # The slowest files so far
+
+    def add(self, record):
+        if record is None:
+            return
+        self.files += 1
+        self.wall_s += record["wall_s"]
+        self.cpu_s += record["cpu_s"]
+        for name, (wall, cpu) in record["phases"].items():
+            times = self.phases.setdefault(name, [0.0, 0.0])
+            times[0] += wall
+            times[1] += cpu
+        if record["peak_memory_KiB"] is not None:
+            self.peak_memory_KiB = max(self.peak_memory_KiB or 0.0, record["peak_memory_KiB"])
+        self._records.append(record)
+        if len(self._records) > 2 * self.slowest:
+            self._records = sorted(self._records, key=lambda r: r["wall_s"], reverse=True)[:self.slowest]
+
+    def as_dict(self, **extra):
+        order = {name: i for i, name in enumerate(PHASES)}
+        phases = {
+            name: {"wall_s": wall, "cpu_s": cpu, "wall_share": wall / self.wall_s if self.wall_s else None}
+            for name, (wall, cpu) in sorted(self.phases.items(), key=lambda item: order.get(item[0], len(order)))
+        }
+        return dict(extra,
+                    files=self.files,
+                    wall_s=self.wall_s,
+                    cpu_s=self.cpu_s,
+                    peak_file_memory_KiB=self.peak_memory_KiB,
+                    phases=phases,
+                    slowest_files=sorted(self._records, key=lambda r: r["wall_s"], reverse=True)[:self.slowest])
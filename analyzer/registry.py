@@ -0,0 +1,145 @@
+from time import perf_counter
+from .structural import NodeKey, NodeSet
+from .stats import PatternStats, VISITS, MATCHES, SECONDS, CACHE_HITS
+
+# The built-in patterns of analyzer/patterns as (module, class) pairs, in the order they are tried (the first recognising pattern wins).
+# Listed here, so loading them needs neither scanning the folder, nor checking every class of it. Keep it in sync with the folder:
+# the order is the one discover_patterns() finds them in.
+BUILTIN_PATTERNS = (
+    ("analyzer.patterns.class_pattern", "ClassPattern"),
+    ("analyzer.patterns.guard_pattern", "GuardPattern"),
+    ("analyzer.patterns.literal_pattern", "LiteralPattern"),
+    ("analyzer.patterns.or_pattern", "OrPattern"),
+    ("analyzer.patterns.singleton_pattern", "SingletonPattern"),
+)
+
+
+class PatternRegistry(tuple):
+    """
+    Tuple of the valid pattern classes, with an index mapping ast node types to the patterns that could recognise them.
+    Patterns declare the node types they can recognise in a static 'NodeTypes' attribute.
+    Patterns without one are tried on every node.
+    """
+
+    def __new__(cls, patterns):
+        self = super().__new__(cls, patterns)
+        # Patterns keep their order in every bucket, since the first recognising pattern wins
+        self._generic = tuple(p for p in self if getattr(p, 'NodeTypes', None) is None)
+        node_types = {t for p in self for t in (getattr(p, 'NodeTypes', None) or ())}
+        self._index = {
+            t: tuple(p for p in self if getattr(p, 'NodeTypes', None) is None or t in p.NodeTypes)
+            for t in node_types
+        }
+        return self
+
+    def candidates(self, node):
+        """Returns the pattern classes, that could recognise the node."""
+        return self._index.get(type(node), self._generic)
+
+    def recognise(self, node):
+        """Returns an instance of the first pattern that recognises the node. Returns None, if no pattern recognises it."""
+        for pattern in self.candidates(node):
+            curr_pattern = pattern()
+            if curr_pattern.visit(node):
+                return curr_pattern
+        return None
+
+    def recognises(self, node, subject):
+        """Returns True, if any pattern recognises the node with the given subject as one of its potential subjects."""
+        for pattern in self.candidates(node):
+            curr_pattern = pattern()
+            if curr_pattern.visit(node) and subject in curr_pattern.potential_subjects():
+                return True
+        return False
+
+
+class Recogniser:
+    """
+    Recognises expressions with the patterns of a registry, and caches the results by the structure of the expression.
+    Meant to be used for the analysis of a single file. Can stand in for the registry as the 'Patterns' of pattern instances,
+    so sub-patterns get recognised through the same cache.
+    Counts the visits, matches, and time of every pattern in its PatternStats.
+    """
+
+    def __init__(self, patterns, stats=None):
+        self.patterns = patterns
+        self._cache = {}  # Mapping the NodeKey of an expression to [(pattern class, potential subjects) of the recognising patterns found, number of tried candidates]
+        self.stats = stats if stats is not None else PatternStats()
+        self._nested = 0.0  # Time spent in the sub-patterns of the pattern being visited
+
+    def clear(self):
+        """Forgets the cached results, before analysing another file."""
+        self._cache.clear()
+
+    def __iter__(self):
+        return iter(self.patterns)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def candidates(self, node):
+        return self.patterns.candidates(node)
+
+    def _instance(self, pattern):
+        curr_pattern = pattern()
+        curr_pattern.Patterns = self
+        return curr_pattern
+
+    def _visit(self, curr_pattern, node, counters):
+        # The time of the sub-patterns, recognised through this Recogniser while visiting, is only counted for them
+        outer, self._nested = self._nested, 0.0
+        start = perf_counter()
+        matched = curr_pattern.visit(node)
+        elapsed = perf_counter() - start
+        counters[SECONDS] += elapsed - self._nested
+        self._nested = outer + elapsed
+        return matched
+
+    def _match(self, node, entry, subject=None):
+        """
+        Tries the candidates of the node, that were not tried yet, until one recognises it (with subject as one of its potential
+        subjects, if given). entry: the cached [recognising (pattern class, potential subjects) pairs, number of tried candidates].
+        Returns the instance of the recognising pattern, or None.
+        """
+        candidates = self.candidates(node)
+        while entry[1] < len(candidates):
+            pattern = candidates[entry[1]]
+            entry[1] += 1
+            counters = self.stats.counters(pattern)
+            curr_pattern = self._instance(pattern)
+            counters[VISITS] += 1
+            if self._visit(curr_pattern, node, counters):
+                counters[MATCHES] += 1
+                # Copying, since a parent pattern might change the subjects of the instance later on
+                subjects = NodeSet(curr_pattern.potential_subjects())
+                entry[0].append((pattern, subjects))
+                if subject is None or subject in subjects:
+                    return curr_pattern
+        return None
+
+    def _entry(self, node):
+        key = NodeKey(node)
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = self._cache[key] = [[], 0]
+        return entry
+
+    def recognise(self, node):
+        """Returns an instance of the first pattern that recognises the node. Returns None, if no pattern recognises it."""
+        entry = self._entry(node)
+        if not entry[0]:
+            return self._match(node, entry)
+        # Patterns are stateful (complex patterns change each other), so every caller gets a new instance,
+        # but only the pattern that is known to recognise the node has to visit it.
+        counters = self.stats.counters(entry[0][0][0])
+        counters[CACHE_HITS] += 1
+        curr_pattern = self._instance(entry[0][0][0])
+        self._visit(curr_pattern, node, counters)
+        return curr_pattern
+
+    def recognises(self, node, subject):
+        """Returns True, if any pattern recognises the node with the given subject as one of its potential subjects."""
+        entry = self._entry(node)
+        if any(subject in subjects for _, subjects in entry[0]):
+            return True
+        return self._match(node, entry, subject) is not None
@@ -0,0 +1,140 @@
+import math
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+
+# Files smaller than this get batched together, so the per-task overhead of the pool doesn't dominate them
+BATCH_BYTES = 64 * 1024
+MAX_BATCH_FILES = 64
+# Discovered files are scheduled in windows, growing from the first to the max size, so work starts right away
+FIRST_WINDOW = 16
+MAX_WINDOW = 4096
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().split()
+    except OSError:
+        return None
+
+
+def _cgroup_path():
+    """Returns the path of this process' cgroup v2 (the '0::<path>' entry of /proc/self/cgroup), or None."""
+    try:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return line[3:].strip()
+    except OSError:
+        pass
+    return None
+
+
+def _cgroup_v2_limit():
+    # The quota may be set on the cgroup of the process (nested in systemd slices, or containers without a cgroup namespace),
+    # or on any of its ancestors, up to the root: the lowest one applies
+    path = _cgroup_path() or "/"
+    limit = None
+    while True:
+        # "<quota> <period>" or "max <period>"
+        fields = _read(os.path.join("/sys/fs/cgroup", path.lstrip("/"), "cpu.max"))
+        if fields and len(fields) == 2 and fields[0] != "max":
+            quota, period = int(fields[0]), int(fields[1])
+            if quota > 0 and period > 0:
+                limit = quota / period if limit is None else min(limit, quota / period)
+        if path in ("", "/"):
+            return limit
+        path = os.path.dirname(path.rstrip("/"))
+
+
+def cgroup_cpu_limit():
+    """Returns the number of CPUs the cgroup of this process is allowed to use (rounded up), or None if it is not limited."""
+    limit = _cgroup_v2_limit()
+    if limit is None:
+        # cgroup v1
+        quota = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") or _read("/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us")
+        period = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us") or _read("/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us")
+        if not quota or not period:
+            return None
+        quota, period = int(quota[0]), int(period[0])
+        if quota <= 0 or period <= 0:
+            return None
+        limit = quota / period
+    return max(1, math.ceil(limit))
+
+
+def default_workers():
+    """Returns the number of workers to use: the CPUs this process may run on, limited by the cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on Windows and macOS
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    return max(1, min(cpus, limit) if limit is not None else cpus)
+
+
+def file_size(path):
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+def make_batches(sizes, batch_bytes=BATCH_BYTES, max_files=MAX_BATCH_FILES):
+    """
+    Returns a list of batches (lists of indexes into sizes), ordered largest first,
+    so a huge file never starts last while the other workers sit idle.
+    Files at least batch_bytes large get a batch of their own, the smaller ones are packed together.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True)
+    batches = []
+    batch, total = [], 0
+    for i in order:
+        if sizes[i] >= batch_bytes:
+            batches.append([i])
+            continue
+        batch.append(i)
+        total += sizes[i]
+        if total >= batch_bytes or len(batch) >= max_files:
+            batches.append(batch)
+            batch, total = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def stream_batches(items, size_of, first_window=FIRST_WINDOW, max_window=MAX_WINDOW):
+    """
+    Yields batches (lists) of the items, coming from an iterator. The items are scheduled in windows: each window is
+    batched with make_batches(), so the largest files of the window go first. size_of: returns the size of an item in bytes.
+    """
+    window = []
+    window_size = first_window
+    for item in items:
+        window.append(item)
+        if len(window) >= window_size:
+            yield from ([window[i] for i in batch] for batch in make_batches([size_of(item) for item in window]))
+            window = []
+            window_size = min(window_size * 2, max_window)
+    if window:
+        yield from ([window[i] for i in batch] for batch in make_batches([size_of(item) for item in window]))
+
+
+def run_batches(executor, func, batches, max_in_flight):
+    """
+    Submits the batches of items to the executor, calling func with each batch, which must return the list of results of its items.
+    At most max_in_flight batches are submitted at once, the next ones are only taken from the iterable as these complete.
+    Yields (item, result) tuples, in the order of completion.
+    """
+    batches = iter(batches)
+    pending = {}
+    while True:
+        for batch in batches:
+            pending[executor.submit(func, batch)] = batch
+            if len(pending) >= max_in_flight:
+                break
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield from zip(pending.pop(future), future.result())
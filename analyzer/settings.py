@@ -0,0 +1,132 @@
+from .utils import log_level
+
+_TRUE = ("1", "yes", "true", "on")
+_FALSE = ("0", "no", "false", "off")
+
+
+def _parse(kind, value):
+    """Converts an option's string value, the way ConfigParser's getboolean/getint would."""
+    value = value.strip()
+    if kind == "bool":
+        if value.lower() in _TRUE:
+            return True
+        if value.lower() in _FALSE:
+            return False
+        raise ValueError(f"Not a boolean: {value!r}")
+    if kind == "int":
+        return int(value)
+    if kind == "list":  # Comma separated
+        return tuple(item.strip() for item in value.split(",") if item.strip())
+    if kind == "level":
+        return log_level(value)
+    return value
+
+
+# The fields of Settings: (field, section, option, kind), named after the options, see config.ini for their meaning
+_FIELDS = (
+    ("minimum_branches", "MAIN", "MinimumBranches", "int"),
+    ("visit_recursively", "MAIN", "VisitBodiesRecursively", "bool"),
+    ("preserve_comments", "MAIN", "PreserveComments", "bool"),
+    ("pre_filter", "MAIN", "PreFilter", "bool"),
+    ("discover_patterns", "MAIN", "DiscoverPatterns", "bool"),
+
+    ("allow_flattening", "FLATTENING", "AllowFlattening", "bool"),
+    ("code_repetition_allowed", "FLATTENING", "CodeRepetitionAllowed", "bool"),
+    ("max_repeated_lines", "FLATTENING", "MaxRepeatedLines", "int"),
+    ("allow_ugly_flattening", "FLATTENING", "AllowUglyFlattening", "bool"),
+
+    ("allow_cache", "CACHE", "AllowCache", "bool"),
+    ("cache_folder", "CACHE", "CacheFolderPath", "str"),
+    ("max_cache_size_MiB", "CACHE", "MaxCacheSizeMiB", "int"),
+
+    ("use_gitignore", "DISCOVERY", "UseGitignore", "bool"),
+    ("exclude", "DISCOVERY", "Exclude", "list"),
+
+    ("output_folder_path", "OUTPUT", "OutputFolderPath", "str"),
+    ("allow_output", "OUTPUT", "AllowOutput", "bool"),
+    ("generate_diffs", "OUTPUT", "GenerateDiffs", "bool"),
+    ("log_level", "OUTPUT", "LogLevel", "level"),
+    ("transformer_logs", "OUTPUT", "AllowTransformerLogs", "bool"),
+    ("analyzer_logs", "OUTPUT", "AllowAnalyzerLogs", "bool"),
+)
+
+
+def _settings(values):
+    # Unpickling, Settings can't be filled attribute by attribute
+    return Settings(**values)
+
+
+class Settings:
+    """
+    The options of config.ini, parsed once. Immutable (and hashable), so it can be shared by threads, sent to the worker processes,
+    and several Transformers with different settings can run in the same process.
+    Attributes are named after the options, see _FIELDS and config.ini for their meaning.
+    A plain class instead of a frozen dataclass, since importing dataclasses (and inspect with it) would slow down the startup.
+    """
+    __slots__ = tuple(name for name, *_ in _FIELDS)
+
+    def __init__(self, **values):
+        missing = [name for name in self.__slots__ if name not in values]
+        unknown = [name for name in values if name not in self.__slots__]
+        if missing or unknown:
+            raise TypeError(f"Settings: missing fields {missing}, unknown fields {unknown}")
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Settings are immutable, cannot set '{name}', see with_options()")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Settings are immutable, cannot delete '{name}'")
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return self._values() == other._values() if type(other) is type(self) else NotImplemented
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return "Settings(" + ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__) + ")"
+
+    def __reduce__(self):
+        return _settings, (dict(zip(self.__slots__, self._values())),)
+
+    @classmethod
+    def from_config(cls, config):
+        """Returns the settings read from a ConfigParser. Raises ValueError on a missing or invalid option."""
+        values = {}
+        for name, section, option, kind in _FIELDS:
+            try:
+                values[name] = _parse(kind, config[section][option])
+            except KeyError:
+                raise ValueError(f"Missing option: [{section}] {option}") from None
+            except ValueError as error:
+                raise ValueError(f"Invalid option [{section}] {option}: {error}") from None
+        return cls(**values)
+
+    def with_options(self, options):
+        """
+        Returns a copy of the settings with the given options changed. options: (name, value) pairs, where name is the name of
+        an option in config.ini (case insensitive, e.g. MinimumBranches) or of a field, and value is its string value.
+        Raises ValueError on an unknown option or an invalid value.
+        """
+        fields = {}
+        for field in _FIELDS:
+            fields[field[0].lower()] = fields[field[2].lower()] = field
+        values = dict(zip(self.__slots__, self._values()))
+        for name, value in options:
+            field = fields.get(name.strip().lower())
+            if field is None:
+                raise ValueError(f"Unknown option: {name}")
+            try:
+                values[field[0]] = _parse(field[3], value)
+            except ValueError as error:
+                raise ValueError(f"Invalid option {field[2]}: {error}") from None
+        return Settings(**values)
+
+    def section(self, section):
+        """Returns the (option, value) pairs of a config section."""
+        return [(option, getattr(self, name)) for name, field_section, option, _ in _FIELDS if field_section == section]
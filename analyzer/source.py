@@ -0,0 +1,112 @@
+import io
+import tokenize
+from bisect import bisect_right
+
+from .comments import CommentIndex
+
+# Tokens, that are not part of any logical line, or don't start one
+_NON_LOGICAL_TOKENS = (tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT, tokenize.ENCODING, tokenize.ENDMARKER)
+
+
+def logical_line_ends(tokens, line_count):
+    """
+    Returns a list, mapping every physical line number (1-based) to the last physical line of the logical line it belongs to.
+    Lines that are not part of a logical line (blank or comment-only lines) are mapped to themselves.
+    """
+    ends = list(range(line_count + 2))
+    start = None
+    for token in tokens:
+        if token.type in _NON_LOGICAL_TOKENS:
+            continue
+        if token.type == tokenize.NEWLINE:
+            if start is not None:
+                end = token.start[0]
+                for row in range(start, end + 1):
+                    ends[row] = end
+            start = None
+        elif start is None:
+            start = token.start[0]
+    return ends
+
+
+class SourceFile:
+    """
+    Per-file state of a transformation: the decoded source, the indexes built from it on demand, and the results.
+    Every transformation works on its own SourceFile, so nothing is shared between files, or Transformers.
+
+    text: the source code. "\r\n" and "\r" newlines get translated to "\n", the first one found is used to write the results back.
+    encoding: the encoding used to write the results back.
+    line_ranges: optional list of (first, last) line number tuples. If given, only If-nodes overlapping these lines get transformed.
+    """
+
+    def __init__(self, file, text, encoding="utf-8", preserve_comments=True, line_ranges=None):
+        self.file = file
+        self.encoding = encoding
+        self.newline = "\n"
+        if "\r" in text:
+            first = text.find("\r")
+            lf = text.find("\n")
+            if lf == -1 or lf >= first:
+                self.newline = "\r\n" if text.startswith("\r\n", first) else "\r"
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        self.text = text
+        self.lines = tuple(io.StringIO(text).readlines())
+        self.preserve_comments = preserve_comments
+        self.line_ranges = sorted(line_ranges) if line_ranges is not None else None
+        # Mapping the first row (0-based) of the og If-nodes to their transformed counterpart, the row they end at, and their subject
+        self.results = {}
+        self._tokens = None
+        self._logical_ends = None
+        self._comments = None
+
+    @classmethod
+    def from_bytes(cls, file, data, preserve_comments=True, line_ranges=None):
+        """
+        Decodes the bytes of a source file honouring its encoding cookie (or BOM), translating newlines like text mode reading does.
+        Raises SyntaxError or UnicodeDecodeError, if it cannot be decoded.
+        """
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+        return cls(file, data.decode(encoding), encoding, preserve_comments, line_ranges)
+
+    def encode(self, text):
+        """Encodes the text in the encoding, and with the newlines of the source file."""
+        if self.newline != "\n":
+            text = text.replace("\n", self.newline)
+        return text.encode(self.encoding)
+
+    def index(self):
+        """Builds the token based indexes (logical lines, comments) now, instead of on their first use."""
+        self.comments()
+        if self._logical_ends is None:
+            self._logical_ends = logical_line_ends(self.tokens(), len(self.lines))
+
+    def tokens(self):
+        """Returns the list of tokens of the source file. Tokenizes the file on the first call only."""
+        if self._tokens is None:
+            self._tokens = list(tokenize.generate_tokens(iter(self.lines).__next__))
+        return self._tokens
+
+    def logical_line_length(self, row):
+        """Returns the number of physical lines from the given row (1-based) to the end of the logical line containing it."""
+        if self._logical_ends is None:
+            self._logical_ends = logical_line_ends(self.tokens(), len(self.lines))
+        if not 0 < row < len(self._logical_ends):
+            return 1
+        return self._logical_ends[row] - row + 1
+
+    def comments(self):
+        """Returns the CommentIndex of the file, which is empty when comments are not preserved."""
+        if self._comments is None:
+            if self.preserve_comments:
+                self._comments = CommentIndex.from_tokens(self.tokens(), self.lines)
+            else:
+                self._comments = CommentIndex(len(self.lines))
+        return self._comments
+
+    def is_changed(self, node):
+        """Returns True, if the If-node overlaps any of the changed line ranges (or if every line counts as changed)."""
+        if self.line_ranges is None:
+            return True
+        # Ranges are sorted, checking the last one that starts before the node ends
+        i = bisect_right(self.line_ranges, (node.end_lineno, float('inf'))) - 1
+        return i >= 0 and self.line_ranges[i][1] >= node.lineno
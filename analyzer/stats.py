@@ -0,0 +1,116 @@
+from enum import Enum
+
+
+class Rejection(Enum):
+    """Why an If-node was rejected by the Analyzer."""
+    NO_PATTERN = "no_pattern"  # A branch is not recognised by any pattern
+    NO_COMMON_SUBJECT = "no_common_subject"  # The patterns of the branches have no subject in common
+    TOO_FEW_BRANCHES = "too_few_branches"  # Less branches than MinimumBranches
+
+
+# Index of the per-pattern counters
+VISITS, MATCHES, SECONDS, CACHE_HITS = range(4)
+
+
+class PatternStats:
+    """
+    Counters of a run: the visits, matches, time spent (exclusive of the sub-patterns it recognises), and cache hits of each
+    pattern class, the number of analysed files and If-nodes, the rejected If-nodes by Rejection, and the branches whose
+    flattening was dropped, since it would result in ugly guards (their If-nodes may still be transformed).
+    Cheap enough to be always on: a few integer additions, and two perf_counter() calls per pattern visit.
+    The workers drain their counters with each file, the main process merges them.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.patterns = {}  # Mapping the name of a pattern class to its [visits, matches, seconds, cache hits]
+        self.rejections = {}  # Mapping Rejection values to counts
+        self.files = 0
+        self.if_nodes = 0
+        self.transformable = 0
+        self.flattening_dropped = 0
+
+    def counters(self, pattern):
+        counters = self.patterns.get(pattern.__name__)
+        if counters is None:
+            counters = self.patterns[pattern.__name__] = [0, 0, 0.0, 0]
+        return counters
+
+    def reject(self, reason):
+        self.rejections[reason.value] = self.rejections.get(reason.value, 0) + 1
+
+    def __bool__(self):
+        return bool(self.files or self.patterns)
+
+    def drain(self):
+        """Returns the counters collected since the last call as a dict (see as_dict()), or None if nothing was counted, and resets them."""
+        if not self:
+            return None
+        data = self.as_dict()
+        self.clear()
+        return data
+
+    def merge(self, data):
+        """Adds the counters of a dict returned by drain() or as_dict()."""
+        if data is None:
+            return
+        for name, counts in data["patterns"].items():
+            counters = self.patterns.setdefault(name, [0, 0, 0.0, 0])
+            counters[VISITS] += counts["visits"]
+            counters[MATCHES] += counts["matches"]
+            counters[SECONDS] += counts["seconds"]
+            counters[CACHE_HITS] += counts["cache_hits"]
+        for reason, count in data["rejections"].items():
+            self.rejections[reason] = self.rejections.get(reason, 0) + count
+        self.files += data["files"]
+        self.if_nodes += data["if_nodes"]
+        self.transformable += data["transformable"]
+        self.flattening_dropped += data["flattening_dropped"]
+
+    def as_dict(self):
+        return {
+            "files": self.files,
+            "if_nodes": self.if_nodes,
+            "transformable": self.transformable,
+            "flattening_dropped": self.flattening_dropped,
+            "rejections": {reason.value: self.rejections.get(reason.value, 0) for reason in Rejection},
+            "patterns": {
+                name: {"visits": c[VISITS], "matches": c[MATCHES], "seconds": c[SECONDS], "cache_hits": c[CACHE_HITS]}
+                for name, c in sorted(self.patterns.items())
+            },
+        }
+
+    def to_prometheus(self, prefix="transpy"):
+        """Returns the counters in the Prometheus text exposition format, e.g. for the textfile collector of node_exporter."""
+        lines = []
+
+        def metric(name, help, samples):
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        data = self.as_dict()
+        metric("files_analyzed_total", "Files analysed (not skipped by the pre-filter or served from the cache).", [("", data["files"])])
+        metric("if_nodes_total", "If-nodes analysed.", [("", data["if_nodes"])])
+        metric("if_nodes_transformable_total", "If-nodes found transformable.", [("", data["transformable"])])
+        metric("rejections_total", "Rejected If-nodes by reason.",
+               [(f'{{reason="{reason}"}}', count) for reason, count in data["rejections"].items()])
+        metric("flattening_dropped_total", "Branches not flattened, since it would result in ugly guards.", [("", data["flattening_dropped"])])
+        patterns = data["patterns"].items()
+        metric("pattern_visits_total", "Expressions visited by the pattern.", [(f'{{pattern="{name}"}}', c["visits"]) for name, c in patterns])
+        metric("pattern_matches_total", "Expressions recognised by the pattern.", [(f'{{pattern="{name}"}}', c["matches"]) for name, c in patterns])
+        metric("pattern_seconds_total", "Time spent in the pattern, without its sub-patterns.", [(f'{{pattern="{name}"}}', c["seconds"]) for name, c in patterns])
+        metric("pattern_cache_hits_total", "Recognitions of the pattern answered from the per-file cache.", [(f'{{pattern="{name}"}}', c["cache_hits"]) for name, c in patterns])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes the counters to path: in the Prometheus text format if it ends with '.prom', as JSON otherwise."""
+        import json
+        with open(path, "w") as f:
+            if str(path).endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.as_dict(), f, indent=4)
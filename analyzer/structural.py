@@ -0,0 +1,117 @@
+import ast
+
+# Name of the attribute the memoized hash is stored in on each node.
+_HASH_ATTR = "_structural_hash"
+
+
+def structural_hash(node):
+    """
+    Returns a hash of the nodes structure (its type and fields, ignoring line information).
+    The hash is computed once per node, bottom-up, and memoized on the node itself,
+    so nodes should not be mutated after they were hashed.
+    """
+    h = getattr(node, _HASH_ATTR, None)
+    if h is None:
+        h = hash((type(node), *(_field_hash(getattr(node, field, None)) for field in node._fields)))
+        setattr(node, _HASH_ATTR, h)
+    return h
+
+
+def _field_hash(value):
+    if isinstance(value, ast.AST):
+        return structural_hash(value)
+    if isinstance(value, list):
+        return hash(tuple(_field_hash(v) for v in value))
+    # Including the type, so 1, 1.0 and True are not the same constant
+    return hash((type(value), value))
+
+
+def structural_eq(a, b):
+    """Returns True if the two nodes (or lists of nodes) have the same structure. Works like comparing their ast.dump()"""
+    if a is b:
+        return True
+    if isinstance(a, ast.AST):
+        if type(a) is not type(b) or structural_hash(a) != structural_hash(b):
+            return False
+        return all(structural_eq(getattr(a, field, None), getattr(b, field, None)) for field in a._fields)
+    if isinstance(a, list):
+        return isinstance(b, list) and len(a) == len(b) and all(map(structural_eq, a, b))
+    return type(a) is type(b) and a == b
+
+
+def remove_node(nodes, node):
+    """Removes the first node from the list, that has the same structure as the given node. Returns True if a node was removed."""
+    for i in range(len(nodes)):
+        if structural_eq(nodes[i], node):
+            del nodes[i]
+            return True
+    return False
+
+
+class NodeKey:
+    """Wraps an ast node, so it can be used as a dict key / set member, that compares by structure."""
+    __slots__ = ("node", "_hash")
+
+    def __init__(self, node):
+        self.node = node
+        self._hash = structural_hash(node)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return isinstance(other, NodeKey) and structural_eq(self.node, other.node)
+
+
+class NodeSet:
+    """
+    A set of ast nodes, where nodes with the same structure count as the same member.
+    Used for the potential subjects of patterns. Keeps insertion order, pop() removes the earliest added node.
+    """
+
+    def __init__(self, nodes=()):
+        self._nodes = {}
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _of(nodes):
+        # Plugins might still return plain sets
+        return nodes if isinstance(nodes, NodeSet) else NodeSet(nodes)
+
+    def add(self, node):
+        self._nodes.setdefault(NodeKey(node), node)
+
+    def copy(self):
+        res = NodeSet()
+        res._nodes = self._nodes.copy()
+        return res
+
+    def intersection(self, other):
+        other = NodeSet._of(other)
+        res = NodeSet()
+        res._nodes = {key: node for key, node in self._nodes.items() if key in other._nodes}
+        return res
+
+    def union(self, other):
+        res = self.copy()
+        for key, node in NodeSet._of(other)._nodes.items():
+            res._nodes.setdefault(key, node)
+        return res
+
+    def pop(self):
+        if not self._nodes:
+            raise KeyError("pop from an empty NodeSet")
+        return self._nodes.pop(next(iter(self._nodes)))
+
+    def __contains__(self, node):
+        return isinstance(node, ast.AST) and NodeKey(node) in self._nodes
+
+    def __iter__(self):
+        return iter(self._nodes.values())
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __repr__(self):
+        return f"NodeSet({[ast.unparse(node) for node in self._nodes.values()]})"
@@ -1,167 +1,180 @@
 import ast
-import io
 import os
-import subprocess
-import tokenize
-
-from analyzer import Analyzer, config
-from .utils import OutputHandler
-from functools import lru_cache
-import difflib
-from tokenize import generate_tokens
-import astor
-
-
-@lru_cache(maxsize=128)
-def is_inside_if(lines, pos, base_indent):
-    # Supposing that base_indent is the indentation of the If-node returns True if the lines[pos] is inside that If-node
-    indent = indentation(lines[pos])
-    stripped = lines[pos].strip()
-
-    if (stripped.startswith("#") or not bool(stripped)):  # Empty / comment lines, have to check ahead if possible.
-        if pos + 1 < len(lines):
-            return is_inside_if(lines, pos + 1, base_indent)
-        return False
-
-    if indent > base_indent:
-        # Line is indented inside base_indent
-        return True
-    elif indent == base_indent:  # Line is at the same indentation
-        if (stripped.startswith("else:") or stripped.startswith("elif") or stripped.startswith(")")):
-            return True  # its just another branch or multiline test
+import stat
 
-    return False
+from analyzer import Analyzer, default_settings
+from logging import ERROR, WARNING
+from .utils import OutputHandler, atomic_write, replace_file
+from .prefilter import might_transform
+from .cache import ResultCache
+from .source import SourceFile
+from .patch import outermost, unified_hunks
+from contextlib import nullcontext
 
 
-def count_actual_lines(lines, pos):
-    # At pos is the beginning of the If-node in the source code's string of lines
-    offset = 0
-    if not lines[pos].startswith('if'):
-        while not lines[pos + offset].strip().startswith('if'):
-            offset -= 1
+def splice(src_lines, results):
+    """
+    Returns the list of source lines, with the transformed If-nodes spliced in, in one ordered pass.
+    results: Mapping the first row (0-based) of each transformed If-node to a tuple of (new lines, end row (exclusive), ...).
+    Nodes nested inside an already replaced node are skipped, the outer node's new lines contain them.
+    """
+    new_lines = []
+    pos = 0
+    for start, end, lines in outermost(results):
+        new_lines.extend(src_lines[pos:start])
+        line = src_lines[start]
+        indent = line[:len(line) - len(line.lstrip())]
+        new_lines.extend(indent + newLine for newLine in lines)
+        pos = end
+    new_lines.extend(src_lines[pos:])
+    return new_lines
 
-    base_indent = indentation(lines[pos + offset])
-    res = 1 - offset
-    pos += 1
-    while pos < len(lines) and is_inside_if(lines, pos, base_indent):
-        res += 1
-        pos += 1
-    return (res, offset)
 
+from textwrap import dedent
 
-def indentation(s, tabsize=4):
-    sx = s.expandtabs(tabsize)
-    return 0 if sx.isspace() else len(sx) - len(sx.lstrip())
+_NULL = nullcontext()  # The phase of the Transformer, when not profiling
+_UNSET = object()  # The cache of the Transformer, before its first use
 
 
-def count_spaces(code):
+class NodeResult:
     """
-    Counts the number of spaces before the first non-space character in the first line of code.
+    A transformed If-node.
+    lineno, end_lineno: the span of the original If-node (1-based, inclusive)
+    subject: the source code of the subject of the new match statement
+    text: the source code of the match statement replacing the If-node, indented like the If-node was
+    """
+    __slots__ = ("lineno", "end_lineno", "subject", "text")
+
+    def __init__(self, lineno, end_lineno, subject, text):
+        self.lineno = lineno
+        self.end_lineno = end_lineno
+        self.subject = subject
+        self.text = text
+
+    def __repr__(self):
+        return f"NodeResult(lineno={self.lineno}, end_lineno={self.end_lineno}, subject={self.subject!r})"
 
-    Parameters:
-    code (str): The code to count spaces in.
 
-    Returns:
-    int: The number of spaces before the first non-space character in the first line of code.
+class TransformResult:
+    """
+    The result of transforming a source.
+    text: the transformed source code (the original one, if nothing was transformed)
+    nodes: list of NodeResults, one for every transformed If-node in source order. Nested nodes are listed too,
+        but their lines are already part of the outer node's lines.
+    visited_nodes: the number of If-nodes visited
+    newline: the newline of the source ("\n", "\r\n" or "\r"), text always uses "\n"
     """
-    count = 0
-    for char in code:
-        if char == ' ':
-            count += 1
-        elif char == '\n':
-            return count
-        else:
-            return count
-    return count
 
+    def __init__(self, source, visited_nodes=0):
+        self.text = "".join(splice(source.lines, source.results)) if source.results else source.text
+        self.nodes = []
+        for row in sorted(source.results):
+            lines, end, subject = source.results[row]
+            indent = source.lines[row][:len(source.lines[row]) - len(source.lines[row].lstrip())]
+            self.nodes.append(NodeResult(row + 1, end, subject, "".join(indent + line for line in lines)))
+        self.visited_nodes = visited_nodes
+        self.newline = source.newline
+        self._lines = source.lines
+        self._results = source.results
+
+    def diff(self, context=3, newline="\n"):
+        """
+        Returns the hunks of the unified diff of the transformation (without the file header, see patch.file_header()).
+        newline: the line ending of the diffed lines.
+        """
+        return unified_hunks(self._lines, self._results, context, newline)
 
-from textwrap import dedent
+    @property
+    def changed(self):
+        return bool(self.nodes)
+
+    def __repr__(self):
+        return f"TransformResult(nodes={self.nodes!r}, visited_nodes={self.visited_nodes})"
 
 
 class Transformer(ast.NodeTransformer):
 
-    def __init__(self):
-        self.analyzer = Analyzer()
-        self.results = {}  # Mapping the linenos of the og If-nodes to their transformed counterpart
-        self.visit_recursively = config["MAIN"].getboolean("VisitBodiesRecursively")
-        self.preserve_comments = config["MAIN"].getboolean("PreserveComments")
-        self.logger = OutputHandler("transformer.log") if config["OUTPUT"].getboolean("AllowTransformerLogs") else None
-        self.generate_diffs = config["OUTPUT"].getboolean("GenerateDiffs")
+    def __init__(self, output_folder=None, settings=None, diagnostics=False):
+        """diagnostics: collect the log records (see drain_logs()) even without an output folder."""
+        self.output_folder = output_folder
+        self.settings = settings = settings if settings is not None else default_settings()
+        self.analyzer = Analyzer(output_folder, settings, diagnostics)
+        self.source = None  # SourceFile of the file being transformed, holds every per-file state
+        self.visit_recursively = settings.visit_recursively
+        self.preserve_comments = settings.preserve_comments
+        self.logger = OutputHandler("transformer.log", output_folder, settings.log_level, diagnostics) if settings.transformer_logs or diagnostics else None
+        self.generate_diffs = settings.generate_diffs
+        self.pre_filter = settings.pre_filter
         self.visited_nodes = 0
-        self.code = None
-        self.src_lines = None
-
-    def log(self, text):
+        self.skipped = False  # True, if the pre-filter rejected the file without parsing it
+        self._cache = _UNSET
+        self.cached = False  # True, if the results came from the cache
+        self.diff = None  # The diff hunks of the written file in bytes, if diffs are generated
+        self.profiler = None  # Profiler measuring the phases of the transformation, if profiling
+
+    @property
+    def cache(self):
+        """The ResultCache of transform() (None, if caching is disabled). Built on first use, since the in-memory API never needs it."""
+        if self._cache is _UNSET:
+            self._cache = ResultCache.from_config(self.settings)
+        return self._cache
+
+    @property
+    def results(self):
+        return self.source.results if self.source is not None else {}
+
+    def log(self, level, msg, *args):
         if self.logger is not None:
-            self.logger.log(text)
+            self.logger.log(level, msg, *args)
+
+    def _phase(self, name):
+        return self.profiler.phase(name) if self.profiler is not None else _NULL
+
+    def drain_logs(self):
+        """Returns the log records of the Transformer and its Analyzer collected since the last call, see OutputHandler.drain()."""
+        records = []
+        for logger in (self.logger, self.analyzer.logger):
+            if logger is not None:
+                records.extend(logger.drain())
+        return records
 
     def visit_If(self, node):
-        global comments, src_rownum, multiline_rownum
+        src_rownum = 0
+        multiline_rownum = 0
 
         def comment_nl_inserter(row: str, last_row: bool, add_nl: bool = True) -> str:
             """
                 row: a string representing a single row of unparsed ast code without comments or newlines.
                 add_nl: a boolean value indicating whether a newline character should be added to row or not.
 
-                comments: a dictionary containing comments and newlines to be inserted into the code rows.
-                    The keys of the dictionary are strings of the form in{rownum}, out{rownum},
-                    or nl{rownum} where rownum is an integer representing the row number of the original code.
-                    The values of the dictionary are the comments themselves, as strings.
+                comments: a CommentIndex of the comments and empty lines to be inserted into the code rows,
+                    indexed by the row number of the original code.
 
                 src_rownum: an integer representing the current row number being processed.
                 multiline_rownum: an integer representing the current row number of a multiline block being processed.
             """
-            global src_rownum, multiline_rownum
-            if f"in{src_rownum}" in comments:
-                row += "  " + comments[f"in{src_rownum}"]
-            if f"out{src_rownum + 1}" in comments and not last_row:
-                if add_nl:
-                    row += "\n" + " " * 4 + comments[f"out{src_rownum + 1}"]
-                else:
-                    row += "  " + comments[f"out{src_rownum + 1}"]
-                    multiline_rownum -= 1
-                src_rownum += 1
-                return comment_nl_inserter(row, last_row=last_row, add_nl=add_nl)
-            if f"nl{src_rownum + 1}" in comments and not last_row:
-                if add_nl:
-                    row += "\n"
+            nonlocal src_rownum, multiline_rownum
+            while True:
+                inline = comments.inline_comment(src_rownum)
+                if inline is not None:
+                    row += "  " + inline
+                if last_row:
+                    return row
+                full = comments.full_comment(src_rownum + 1)
+                if full is not None:
+                    if add_nl:
+                        row += "\n" + " " * 4 + full
+                    else:
+                        row += "  " + full
+                        multiline_rownum -= 1
+                elif comments.is_blank(src_rownum + 1):
+                    if add_nl:
+                        row += "\n"
+                    else:
+                        multiline_rownum -= 1
                 else:
-                    multiline_rownum -= 1
+                    return row
                 src_rownum += 1
-                return comment_nl_inserter(row, last_row=last_row, add_nl=add_nl)
-            return row
-
-        def get_multiline_rownum(i_from: int, i_to: int) -> int:
-            """
-            It takes two indices i_from and i_to that define a range of rows in the source code of the object.
-            The function then determines the number of lines that this range of code should occupy when it is
-            split into multiple lines.
-
-            i_from: An integer representing the index of the first row of the code range.
-            i_to: An integer representing the index of the last row of the code range.
-            """
-            original_code = "".join(self.src_lines[i_from:i_to])
-            if dedent(original_code).startswith("else:") or dedent(original_code).startswith("try:") or dedent(original_code).startswith("except "):
-                return 1
-            original_code = dedent(original_code)
-            original_code = original_code.lstrip()
-            original_code = original_code.replace("elif", "if")
-            try:
-                ast.unparse(ast.parse(dedent(original_code)))
-                return i_to - i_from
-            except (IndentationError, SyntaxError):
-                try:
-                    # can we parse and unparse with an added line 'pass'
-                    ast.unparse(ast.parse(dedent(original_code + (count_spaces(original_code) + 4) * " " + "pass")))
-                    return i_to - i_from
-                except (IndentationError, SyntaxError):
-                    if i_to - i_from > 40:
-                        with open("error.txt", "w") as f:
-                            f.write(f" {os.getcwd()}\n\n\n{original_code}")
-
-                        raise Exception("The length of the multiline statement is longer than 40. Maybe somewhere "
-                                        "it can't recognise the code ending and it gets syntax error recursively")
-                    return get_multiline_rownum(i_from, i_to + 1)
 
         def is_last_row(uast_rownum: int) -> bool:
             """
@@ -172,14 +185,7 @@ class Transformer(ast.NodeTransformer):
                 if len(unparsed_ast.splitlines()) - 1 == uast_rownum:
                     return True
 
-        def set_push_furder_lines():
-            original_code = "".join(self.src_lines[src_rownum - 1:src_rownum])
-            if '"""' in original_code:
-                return multiline_rownum - 1
-            return 0
-
-
-        def unparsed_ast_with_comments_and_newlines(unparsed_ast: str) -> (list, int):
+        def unparsed_ast_with_comments_and_newlines(unparsed_ast: str) -> list:
             """
             Input:
             unparsed_ast - a string of unparsed code containing Python AST (Abstract Syntax Tree) nodes as lines.
@@ -189,20 +195,14 @@ class Transformer(ast.NodeTransformer):
 
             Description: This function takes in an unparsed code containing Python AST nodes and adds comments and
             newlines to it. The output is a list of strings containing the parsed code.
-
-            push_furder_in_case_of_muliline_lastrow: if the last row is a multiline sting it will be set a NOT 0 value
-                    and we will add this integer to the transformed length number. With this method we can avoid the
-                    multiline comment disappearing which can result errors in the translated code
-
             """
-            global src_rownum, multiline_rownum
+            nonlocal src_rownum, multiline_rownum
 
             # todo az elso sor az match, semmiképpen nem tarsitzhatunk ehhez kommentet
             # todo
             # todo
             # todo
             # todo
-            push_furder_lines = 0
             uast_store = []
             src_rownum = node.test.lineno - 1
             firstrow = True
@@ -212,7 +212,7 @@ class Transformer(ast.NodeTransformer):
                     uast_store.append(uast_row+"\n") # mindig match
                     while True:
                         # src_rownum += 1
-                        original_code = dedent("".join(self.src_lines[src_rownum - 1:src_rownum])).strip()
+                        original_code = dedent("".join(self.source.lines[src_rownum - 1:src_rownum])).strip()
                         if original_code.startswith("\n") or original_code.startswith('"""') or original_code.startswith(')') or original_code.startswith('}'):
                             src_rownum += 1
                         else:
@@ -220,10 +220,7 @@ class Transformer(ast.NodeTransformer):
                     continue
 
                 last_row = is_last_row(uast_rownum)
-                original_code = "".join(self.src_lines[src_rownum - 1:src_rownum])
-
-                multiline_rownum = get_multiline_rownum(i_from=src_rownum-1, i_to=src_rownum)
-                push_furder_lines = set_push_furder_lines()
+                multiline_rownum = self.source.logical_line_length(src_rownum)
 
 
                 if multiline_rownum > 1:
@@ -246,37 +243,45 @@ class Transformer(ast.NodeTransformer):
                         "Multiline rownum is slower than 1. Probably it is decreased somewhere by 2 times "
                         "instead of one.")
                 uast_store.append(uast_with_comments_nls + "\n")
-            return uast_store, push_furder_lines
+            return uast_store
 
         self.visited_nodes += 1
-        self.analyzer.visit(node)
+        if self.source.is_changed(node):
+            with self._phase("analyze"):
+                self.analyzer.visit(node)
         if node in self.analyzer.subjects.keys():
             subjectNode = self.analyzer.subjects[node]
             _cases = []
-            for branch_num, branch in enumerate(self.analyzer.branches[node]):
-                if branch.flat:
-                    for subBranch in branch.flat:
-                        pattern = self.analyzer.patterns[subBranch]
-                        transformed_branch = ast.match_case(pattern=pattern.transform(subjectNode),
-                                                            guard=pattern.guard(subjectNode),
-                                                            body=subBranch.body)
-                        try:
-                            _cases.append(transformed_branch)
-                        except SyntaxError:
-                            return None
-                else:
-                    _pattern = ast.MatchAs() if branch.test is None else self.analyzer.patterns[branch].transform(
-                        subjectNode)
-                    _guard = None if branch.test is None else self.analyzer.patterns[branch].guard(subjectNode)
-                    temp = ast.Module(body=branch.body, type_ignores=[])
-                    if self.visit_recursively:
-                        self.generic_visit(temp)
-                    transformed_branch = ast.match_case(pattern=_pattern, guard=_guard, body=temp.body)
-                    _cases.append(transformed_branch)
-
-            unparsed_ast = ast.unparse(ast.Match(subject=subjectNode, cases=_cases))
-            unparsed_with_comments, push_furder = unparsed_ast_with_comments_and_newlines(unparsed_ast)
-            self.results[node.test.lineno - 1] = (unparsed_with_comments, push_furder)
+            with self._phase("build"):
+                for branch_num, branch in enumerate(self.analyzer.branches[node]):
+                    if branch.flat:
+                        for subBranch in branch.flat:
+                            pattern = self.analyzer.patterns[subBranch]
+                            transformed_branch = ast.match_case(pattern=pattern.transform(subjectNode),
+                                                                guard=pattern.guard(subjectNode),
+                                                                body=subBranch.body)
+                            try:
+                                _cases.append(transformed_branch)
+                            except SyntaxError:
+                                return None
+                    else:
+                        _pattern = ast.MatchAs() if branch.test is None else self.analyzer.patterns[branch].transform(
+                            subjectNode)
+                        _guard = None if branch.test is None else self.analyzer.patterns[branch].guard(subjectNode)
+                        temp = ast.Module(body=branch.body, type_ignores=[])
+                        if self.visit_recursively:
+                            self.generic_visit(temp)
+                        transformed_branch = ast.match_case(pattern=_pattern, guard=_guard, body=temp.body)
+                        _cases.append(transformed_branch)
+
+            with self._phase("tokenize"):
+                self.source.index()
+                comments = self.source.comments()
+            with self._phase("unparse"):
+                unparsed_ast = ast.unparse(ast.Match(subject=subjectNode, cases=_cases))
+                # The node's exact span, so the splice doesn't have to look for the end of the If-node
+                self.source.results[node.lineno - 1] = (unparsed_ast_with_comments_and_newlines(unparsed_ast), node.end_lineno,
+                                                        ast.unparse(subjectNode))
             return ast.Match(subject=subjectNode, cases=_cases)
         elif self.visit_recursively:
             curr_node = node
@@ -295,128 +300,140 @@ class Transformer(ast.NodeTransformer):
                 break
         return node
 
-    def transform(self, file):
-        # Reading the source file
-        with open(file, "r", encoding='utf-8') as src:
-            try:
-                k = src.read()
-                self.code = k.splitlines()
-                tree = ast.parse(k)
-            except SyntaxError as error:
-                self.log(f"SyntaxError in '{file}': {error.msg} - line({error.lineno})")
-                return
-            except UnicodeDecodeError as error:
-                self.log(f"UnicodeDecodeError in {file}")
-                return
-
-            self.analyzer.file = file
-            global comments
-            comments = None
-            src.seek(0)
-            self.src_lines = tuple(src.readlines())
-            src.seek(0)
-            self.preserved_comments(src)
-            src.seek(0)
-
-            parsed_code = self.visit(tree)
-
-            # Use the `ast.fix_missing_locations()` function to add line information to the parsed AST
-            ast.fix_missing_locations(parsed_code)
-
-            # Convert the parsed AST back to code while preserving indentation
-            transformed_code_str = ast.unparse(parsed_code)
-
-            # Extract comments from the original code
-            tokens = tokenize.generate_tokens(io.StringIO(src.read()).readline)
-            comments = [t for t in tokens if t.type == tokenize.COMMENT]
-
-            # Insert comments into the transformed code
-            transformed_lines = transformed_code_str.splitlines()
-            for comment in comments:
-                line_num = comment.start[0] - 1  # Convert 1-based line numbers to 0-based
-                comment_str = comment.string.strip()
-                transformed_lines.insert(line_num, comment_str)
-
-            # Join the transformed lines into a single string
-            transformed_code_str = "\n".join(transformed_lines)
-
-            if len(self.results.keys()) == 0:
-                return
-
-        i = 0
-        while i < len(self.src_lines):
-            if i in self.results.keys():
-                if_length, offset = count_actual_lines(self.src_lines, i)
-                self.results[i] = (self.results[i][0], if_length+ self.results[i][1])
-                if offset != 0:
-                    self.results[i + offset] = self.results[i]
-            i += 1
-
-        with open(file, "w", encoding='utf-8') as out:
-            i = 0
-            while i < len(self.src_lines):
-                if i in self.results.keys():
-                    indent = indentation(self.src_lines[i])
-                    res = self.results[i][0]
-                    for newLine in res:
-                        out.write(indent * " " + newLine)
-                    i += self.results[i][1] - 1 # todo
-                else:
-                    out.write(self.src_lines[i])
-                i += 1
-        # subprocess.run(["python3.11", "-m", "black","-q", file])
-        # subprocess.run(["python3.11", "-m", "autopep8", file])
+    def _reset(self):
+        self.source = None
+        self.visited_nodes = 0
+        self.skipped = False
+        self.cached = False
+        self.diff = None
+
+    def _might_transform(self, data):
+        return not self.pre_filter or might_transform(data, self.settings.minimum_branches, self.settings.allow_flattening)
+
+    def _transform(self, source):
+        """Transforms the SourceFile, collecting the results into it. Raises SyntaxError, if the source cannot be parsed."""
+        self.source = source
+        with self._phase("parse"):
+            tree = ast.parse(source.text)
+        self.analyzer.reset(source.file)
+        with self._phase("visit"):
+            self.visit(tree)
+
+    def transform_source(self, text, line_ranges=None, filename="<string>"):
+        """
+        Transforms python source code in memory, without touching the disk. Returns a TransformResult.
+        line_ranges: optional list of (first, last) line number tuples. If given, only If-nodes overlapping these lines get transformed.
+        Raises SyntaxError, if the source is not valid python.
+        """
+        self._reset()
+        source = SourceFile(filename, text, preserve_comments=self.preserve_comments, line_ranges=line_ranges)
+        # The pre-filter only looks for ascii keywords, so any encoding will do
+        return self._transform_in_memory(source, text.encode("utf-8", "surrogatepass"))
 
-        # Checking for SyntaxErrors in the transformed file
-        with open(file, "r", encoding='utf-8') as f:
-            new_lines = f.read()
-            f.seek(0)
-            newlines = f.readlines()
+    def transform_bytes(self, data, line_ranges=None, filename="<string>"):
+        """
+        Like transform_source, but takes the content of a python file in bytes, decoded like the file would be (encoding cookie, BOM).
+        Nothing is written, see write_results(). Raises SyntaxError or UnicodeDecodeError, if the source cannot be decoded or parsed.
+        """
+        self._reset()
+        source = SourceFile.from_bytes(filename, data, self.preserve_comments, line_ranges)
+        return self._transform_in_memory(source, data)
+
+    def _transform_in_memory(self, source, data):
+        if not self._might_transform(data):
+            # Unlike files, which are skipped unparsed, sources rejected by the pre-filter still get parsed,
+            # so invalid python raises SyntaxError either way
+            with self._phase("parse"):
+                ast.parse(source.text)
+            self.skipped = True
+            self.source = source
+        else:
+            self._transform(source)
+        return TransformResult(source, self.visited_nodes)
+
+    def transform(self, file, line_ranges=None, target=None):
+        """
+        Transforms the file in place. Returns a TransformResult, or None if the file was skipped, or could not be parsed.
+        line_ranges: optional list of (first, last) line number tuples. If given, only If-nodes overlapping these lines get transformed.
+        target: if given, the transformed file gets written there instead, leaving the original untouched.
+            Nothing is written there, if the file is not changed by the transformation.
+        """
+        self._reset()
+        with self._phase("read"):
+            with open(file, "rb") as raw:
+                data = raw.read()
+        with self._phase("prefilter"):
+            if not self._might_transform(data):
+                self.skipped = True
+                return None
+
+        cache_key = None
+        entry = None
+        if self.cache is not None and line_ranges is None:  # Results depend on the line ranges too, these are not cached
+            with self._phase("cache"):
+                cache_key = self.cache.key(data)
+                entry = self.cache.get(cache_key)
 
         try:
-            pass
-            # ast.parse(new_lines)
-        except SyntaxError as err:
-            self.log(f"REVERTING {file}: SyntaxError: {err.msg} - line({err.lineno})")
-            print("SYNTAX ERR", f"REVERTING {file}: SyntaxError: {err.msg} - line({err.lineno})")
-            with open(file, "w", encoding='utf-8') as f:
-                f.writelines(self.src_lines)
-            return
-
-        if self.generate_diffs and OutputHandler.OUTPUT_FOLDER:
-            import os
-            from pathlib import Path
-
-            diff = difflib.context_diff(self.src_lines, newlines, fromfile=str(file), tofile=str(file))
-            diffile = (OutputHandler.OUTPUT_FOLDER / 'diffs' / f'{os.path.basename(file)}-diffs.diff').resolve()
-
-            with open(diffile, 'w', encoding='utf-8') as f:
-                f.writelines(diff)
-
-    def preserved_comments(self, src):
+            with self._phase("read"):
+                source = SourceFile.from_bytes(file, data, self.preserve_comments, line_ranges)
+            if entry is not None:
+                self.cached = True
+                self.source = source
+                self.visited_nodes = entry["visited_nodes"]
+                source.results = {row: (lines, end, subject) for row, lines, end, subject in entry["results"]}
+            else:
+                self._transform(source)
+        except SyntaxError as error:
+            self.log(WARNING, "SyntaxError in '%s': %s - line(%s)", file, error.msg, error.lineno)
+            return None
+        except UnicodeDecodeError as error:
+            self.log(WARNING, "UnicodeDecodeError in %s", file)
+            return None
+
+        if cache_key is not None and entry is None:
+            with self._phase("cache"):
+                self.cache.put(cache_key, {"visited_nodes": self.visited_nodes,
+                                           "results": [[row, *result] for row, result in self.results.items()]})
+
+        with self._phase("splice"):
+            result = TransformResult(source, self.visited_nodes)
+        if result.changed and not self.write_results(file, data, result, target):
+            return None
+        return result
+
+    def write_results(self, file, data, result, target=None, validate=True):
         """
-        Description: The preserved_comments function takes the original file object as input and reads it line by line,
-        identifying any comments or empty newlines in the code. The function returns a dictionary containing the line
-        number and the comment string iteslf and empty newlines found.
+        Writes the transformed text of the TransformResult to the source file (or to target), if it is valid python.
+        data: the original content of the file. The file is not rewritten, if the new content is the same.
+        validate: False, if the caller has already checked, that the text is valid python.
+        Returns True, if the file was written.
         """
-        global comments
-        if self.preserve_comments:
-            comments = {}
-            src.seek(0)
-            tokens = generate_tokens(src.readline)
-            cyclestart = True
-            for token in tokens:
-                if token.type == 61:
-                    if cyclestart:
-                        comments[f"out{token.start[0]}"] = token.string  # full row comment
-                    else:
-                        comments[f"in{token.start[0]}"] = token.string  # inline comment
-                    cyclestart = False
-                elif token.string == "\n":
-                    cyclestart = True
-                else:
-                    cyclestart = False
-            for i, row in enumerate(self.src_lines):
-                if row.replace(" ", "").replace("\t", "") == "\n":
-                    comments[f"nl{i + 1}"] = True  # empty newline
-        print(comments)
+        # Checking for SyntaxErrors before touching the file
+        if validate:
+            try:
+                with self._phase("validate"):
+                    ast.parse(result.text)
+            except SyntaxError as err:
+                self.log(ERROR, "NOT WRITING %s: SyntaxError: %s - line(%s)", file, err.msg, err.lineno)
+                return False
+
+        with self._phase("write"):
+            new_data = self.source.encode(result.text)
+            if new_data == data:
+                return False
+            if target is None:
+                replace_file(file, new_data)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # Atomic, so a copy of the original placed there meanwhile (maybe a hard link to it) gets replaced, not overwritten
+                atomic_write(target, new_data, stat.S_IMODE(os.stat(file).st_mode))
+        # subprocess.run(["python3.11", "-m", "black","-q", file])
+        # subprocess.run(["python3.11", "-m", "autopep8", file])
+
+        if self.generate_diffs and self.output_folder:
+            # Encoded like the file (without a BOM), so the patch applies to it
+            encoding = "utf-8" if self.source.encoding == "utf-8-sig" else self.source.encoding
+            with self._phase("diff"):
+                self.diff = result.diff(newline=self.source.newline).encode(encoding)
+        return True
@@ -1,16 +1,30 @@
 import ast
 import importlib
-import pkgutil
-import inspect
+import os
+import stat
+import logging
+import time
 from math import inf as Infinity
 from pathlib import Path
 import analyzer.patterns as patterns
-from analyzer import config
-from datetime import datetime
+from .registry import PatternRegistry, BUILTIN_PATTERNS
 import functools
 
-def load_patterns():
-    """Returns a list of valid pattern classes"""
+def load_patterns(discover=False):
+    """
+    Returns a PatternRegistry of the valid pattern classes: the built-in ones, or with discover=True,
+    every valid class found in the modules of the patterns folder (third-party plugins included).
+    """
+    if not discover:
+        return PatternRegistry(getattr(importlib.import_module(module), name) for module, name in BUILTIN_PATTERNS)
+    return discover_patterns()
+
+
+def discover_patterns():
+    """Imports every module of the patterns folder, and returns a PatternRegistry of their classes, that implement PatternBase."""
+    import inspect
+    import pkgutil
+    from analyzer.patterns.Base import PatternBase
     result = []
     # Loading python modules from patterns folder
     Modules = {
@@ -22,16 +36,16 @@ def load_patterns():
         # Checking every class in the module
         for name, cls in inspect.getmembers(Modules[plugin_name], inspect.isclass):
             #print(f"PLUGIN TEST: {name} : {cls}")
-            if issubclass(cls, patterns.Base.PatternBase):
+            if issubclass(cls, PatternBase):
                 result.append(cls)
                 #print(f"{name} succesfully loaded!")
-    return result
+    return PatternRegistry(result)
     
 def _simplify(node, parent):
     # Gets called on each node in the parents BoolOp's values
     new_values = []
     match node:
-        case ast.BoolOp(op, [*values]) if op == parent.op: ## If the node is also a boolOp, with the same operator, we can simplify
+        case ast.BoolOp(op, [*values]) if type(op) is type(parent.op): ## If the node is also a boolOp, with the same operator, we can simplify
             for value in values:
                 for n in _simplify(value, node):
                     new_values.append(n)
@@ -72,7 +86,7 @@ class Branch:
         
         preNest = []
         for i in range(len(self.body)):
-            if self.body[i] == nested_IfNode:
+            if self.body[i] is nested_IfNode:
                 break
             else:
                 preNest.append(self.body[i])
@@ -87,7 +101,7 @@ class Branch:
         postNest = []
         flag = False
         for i in range(len(self.body)):
-            if self.body[i] == nested_IfNode:
+            if self.body[i] is nested_IfNode:
                 flag = True
                 continue
             if flag:
@@ -117,16 +131,16 @@ def get_branches(node) :
                 branches.append(Branch(nodes))
                 return branches
 
-def flatten(branch):
+def flatten(branch, settings):
     """Tries to flatten the branch. Returns a list of the flattened sub-branches. Return None if flattening is not possible. """
     # Cannot 'flatten' else: branches
     # Also, reject branches that have more (or less) than one nested If-node 
-    if branch.test is None or len(branch.nested_Ifs.keys()) != 1 or not(config["FLATTENING"].getboolean("AllowFlattening")):
+    if branch.test is None or len(branch.nested_Ifs.keys()) != 1 or not(settings.allow_flattening):
         return None
 
 
-    if config["FLATTENING"].getboolean("CodeRepetitionAllowed"):
-        max_lenght = config["FLATTENING"].getint("MaxRepeatedLines")
+    if settings.code_repetition_allowed:
+        max_lenght = settings.max_repeated_lines
         if max_lenght == 0:
             max_lenght = Infinity
     else:
@@ -156,33 +170,105 @@ def flatten(branch):
     return flattened
 
 
+def log_level(name):
+    """Returns the number of a logging level name (DEBUG, INFO, WARNING, ERROR)."""
+    level = logging.getLevelName(name.strip().upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level: {name}")
+    return level
+
+
+class Unparsed:
+    """Unparses the node only when formatted, so log records that get filtered out don't pay for it."""
+    __slots__ = ("node",)
+
+    def __init__(self, node):
+        self.node = node
+
+    def __str__(self):
+        return ast.unparse(self.node)
+
+
 class OutputHandler:
-    OUTPUT_FOLDER = None
-    
-    def __new__(cls, filename):
-        if OutputHandler.OUTPUT_FOLDER is None:
+    """
+    Collects the log records of a log file inside the output folder, in memory. Returns None, if there is no output folder.
+    The workers never write the files themselves: the records get drained after every file, and returned to the main process,
+    where the LogWriter writes them. Records under the level are dropped without formatting them.
+    collect: collect the records even without an output folder, to return them some other way (like the daemon's diagnostics).
+    """
+
+    def __new__(cls, filename, output_folder, level=logging.DEBUG, collect=False):
+        if output_folder is None and not collect:
             return None
         instance = super(OutputHandler, cls).__new__(cls)
-        instance.output_file = (OutputHandler.OUTPUT_FOLDER / filename)
+        instance.filename = filename
+        instance.level = level
+        instance.records = []
         return instance
 
-    def write(self, line):
-        if not isinstance(line, str):
-            raise ValueError(f"OutputHandler: {type(line).__name__} is not a string!")
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, msg, *args):
+        """Records the message, formatted with args %-style, if the level is enabled."""
+        if level >= self.level:
+            self.records.append((self.filename, time.time(), level, msg % args if args else msg))
+
+    def drain(self):
+        """Returns the collected records as a list of picklable (filename, time, level, message) tuples, and forgets them."""
+        records = self.records
+        self.records = []
+        return records
+
+
+class LogWriter:
+    """
+    The single writer of the log files in the output folder, run by the main process.
+    Every log file is opened once, and the records coming from the workers are written in batches.
+    """
+
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self._files = {}
+
+    def write(self, records):
+        for filename, created, level, message in records:
+            out = self._files.get(filename)
+            if out is None:
+                out = self._files[filename] = open(Path(self.output_folder) / filename, "a", encoding="utf-8")
+            out.write(f"[{time.strftime('%H:%M:%S', time.localtime(created))}] {logging.getLevelName(level)}: {message}\n\n")
+
+    def close(self):
+        for out in self._files.values():
+            out.close()
+        self._files.clear()
 
-        with open(self.output_file, "a") as out:
-            out.write(line)
+    def __enter__(self):
+        return self
 
-    def writeline(self, line):
-        if not isinstance(line, str):
-            raise ValueError(f"OutputHandler: {type(line).__name__} is not a string!")
+    def __exit__(self, *exc_info):
+        self.close()
 
-        self.write(line + "\n")
 
+def atomic_write(path, data, mode=None):
+    """
+    Writes the bytes to path, through a temporary file in the same folder, that gets renamed into place.
+    Readers see either the old or the new content, never a partial one. mode: the permission bits of the new file.
+    """
+    import tempfile  # Imported on the first write, not at startup
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
 
-    def writelines(self, lines):
-        with open(self.output_file, "a") as out:
-            out.writelines(lines)
 
-    def log(self, line):
-        self.writeline(f"[{datetime.now().strftime('%H:%M:%S')}] "+ line + "\n")
\ No newline at end of file
+def replace_file(path, data):
+    """Atomically replaces the content of the file with the bytes, keeping its permissions. The target of symlinks gets replaced."""
+    path = os.path.realpath(path)
+    atomic_write(path, data, stat.S_IMODE(os.stat(path).st_mode))
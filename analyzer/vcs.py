@@ -0,0 +1,101 @@
+import re
+import subprocess
+from pathlib import Path
+
+# @@ -start[,count] +start[,count] @@
+_HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+# The escapes of C-style quoted path names in git's output
+_ESCAPES = {"a": 7, "b": 8, "t": 9, "n": 10, "v": 11, "f": 12, "r": 13, '"': 34, "\\": 92}
+
+
+class GitError(Exception):
+    pass
+
+
+def _unquote(name):
+    """Returns the path name of a diff header: C-style quoted names (with special characters in them) get unquoted."""
+    if not (len(name) >= 2 and name.startswith('"') and name.endswith('"')):
+        return name
+    out = bytearray()
+    i, body = 0, name[1:-1]
+    while i < len(body):
+        c = body[i]
+        if c == "\\" and i + 1 < len(body):
+            nxt = body[i + 1]
+            if nxt in "01234567":  # An octal byte of a non-ASCII character
+                out.append(int(body[i + 1:i + 4], 8))
+                i += 4
+                continue
+            out.append(_ESCAPES.get(nxt, ord(nxt)))
+            i += 2
+            continue
+        out.extend(c.encode("utf-8", errors="surrogateescape"))
+        i += 1
+    return out.decode("utf-8", errors="surrogateescape")
+
+
+def _git(cwd, *args):
+    try:
+        proc = subprocess.run(["git", "-c", "core.quotePath=false", *args], cwd=cwd,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except FileNotFoundError:
+        raise GitError("git executable is not found!")
+    if proc.returncode != 0:
+        raise GitError(proc.stderr.decode(errors="replace").strip() or f"git {args[0]} failed")
+    return proc.stdout.decode("utf-8", errors="surrogateescape")
+
+
+def git_root(path):
+    """Returns the root of the work tree containing path."""
+    path = Path(path)
+    return Path(_git(path if path.is_dir() else path.parent, "rev-parse", "--show-toplevel").strip()).resolve()
+
+
+def changed_files(path, ref, with_lines=False):
+    """
+    Returns a dict, mapping the python files under path, that were added or modified in the work tree or the index relative to ref,
+    to the list of their changed line ranges: (first, last) tuples, 1-based and inclusive.
+    The ranges are only computed if with_lines is True, otherwise (and for untracked files) they are None, meaning the whole file.
+    """
+    path = Path(path).resolve()
+    root = git_root(path)
+
+    def under_path(file):
+        return file.suffix == ".py" and (file == path or path in file.parents) and file.is_file()
+
+    tracked = [root / name for name in _git(root, "diff", "--name-only", "-z", "--diff-filter=ACMR", ref, "--").split("\0") if name]
+    untracked = [root / name for name in _git(root, "ls-files", "--others", "--exclude-standard", "-z").split("\0") if name]
+
+    result = {file: None for file in tracked if under_path(file)}
+    if with_lines and result:
+        result.update(changed_lines(root, ref, list(result.keys())))
+    for file in untracked:
+        if under_path(file):
+            result[file] = None
+    return result
+
+
+def changed_lines(root, ref, files):
+    """Returns a dict mapping each file to the line ranges of the work tree version, that were added or modified relative to ref."""
+    result = {file: [] for file in files}
+    current = None
+    # The prefixes are given, so diff.noprefix or diff.mnemonicPrefix in the user's config don't change the headers
+    diff = _git(root, "diff", "-U0", "--no-color", "--no-ext-diff", "--src-prefix=a/", "--dst-prefix=b/", ref, "--",
+                *[str(f.relative_to(root)) for f in files])
+    for line in diff.split("\n"):
+        if line.startswith("+++ "):
+            # git ends names with spaces in them with a tab
+            name = _unquote(line[4:].rstrip("\t"))
+            current = (root / name[2:]) if name.startswith("b/") else None
+            continue
+        match = _HUNK_HEADER.match(line)
+        if match and current in result:
+            start = int(match.group(1))
+            count = 1 if match.group(2) is None else int(match.group(2))
+            if count:
+                result[current].append((start, start + count - 1))
+            else:  # Pure deletion after line 'start', touching the lines around it
+                result[current].append((start, start + 1))
+    return result
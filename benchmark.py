@@ -0,0 +1,344 @@
+"""
+Benchmark suite of transpy.
+
+Builds deterministic synthetic corpora (and/or takes local ones, like the Lib/ folder of CPython), transforms a fresh copy
+of each with every given worker count, and reports throughput (files/s, If-nodes/s), per-file latency percentiles,
+and the peak RSS of the main process and the workers. The startup of the CLI is measured too: the time to transform a single
+file from starting the interpreter, like a pre-commit hook does. The results are written as JSON, and can be compared to a baseline.
+
+    python benchmark.py                                   # synthetic corpora, 1, 2, 4.. workers
+    python benchmark.py --corpus /usr/lib/python3.11 -j 1 -j 4 --save results.json
+    python benchmark.py --baseline results.json           # exits with 1, if any run got slower than the tolerance
+
+Every run is a separate process with an empty result cache, so runs don't affect each other.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent
+SEED = 2022
+
+# name: (number of files, generator of one file's source)
+SYNTHETIC = {}
+
+
+def synthetic(name, files):
+    def register(generator):
+        SYNTHETIC[name] = (files, generator)
+        return generator
+    return register
+
+
+@synthetic("elif-chains", files=200)
+def elif_chains(rng, scale):
+    out = []
+    for f in range(int(20 * scale)):
+        out.append(f"def f{f}(x, y):\n")
+        for b in range(rng.randint(3, 25)):
+            keyword = "if" if b == 0 else "elif"
+            value = rng.choice([str(b), f"'{b}'", "None" if b == 1 else str(-b)])
+            test = f"x is {value}" if value == "None" else f"x == {value}"
+            if rng.random() < 0.3:
+                test += f" or x == {b + 1000}"
+            out.append(f"    {keyword} {test}:\n        return y + {b}\n")
+        out.append("    else:\n        return None\n\n")
+    return "".join(out)
+
+
+@synthetic("deep-nesting", files=100)
+def deep_nesting(rng, scale):
+    out = []
+    for f in range(int(10 * scale)):
+        out.append(f"def f{f}(obj):\n")
+        indent = "    "
+        for depth in range(rng.randint(3, 8)):
+            out.append(f"{indent}if isinstance(obj, C{depth}) and obj.a == {depth}:\n{indent}    obj.x()\n")
+            out.append(f"{indent}elif isinstance(obj, D{depth}):\n{indent}    obj.y()\n")
+            out.append(f"{indent}elif obj is None:\n{indent}    pass\n")
+            out.append(f"{indent}else:\n")
+            indent += "    "
+        out.append(f"{indent}return obj\n\n")
+    return "".join(out)
+
+
+@synthetic("comment-heavy", files=100)
+def comment_heavy(rng, scale):
+    out = []
+    for f in range(int(15 * scale)):
+        out.append(f"def f{f}(x):\n    # Dispatching on x\n")
+        for b in range(rng.randint(3, 12)):
+            keyword = "if" if b == 0 else "elif"
+            out.append(f"    # branch {b}\n\n    {keyword} x == {b}:  # inline {b}\n        # body\n")
+            out.append(f"        return call({b},\n                    {b * 2})  # continued\n")
+        out.append("    else:\n        # fallback\n        pass\n\n")
+    return "".join(out)
+
+
+@synthetic("huge-files", files=4)
+def huge_files(rng, scale):
+    return elif_chains(rng, 150 * scale)
+
+
+@synthetic("no-candidates", files=500)
+def no_candidates(rng, scale):
+    # Files the pre-filter rejects, measuring the per-file overhead
+    return "".join(f"def f{i}(x):\n    return x + {rng.randint(0, 100)}\n\n" for i in range(int(20 * scale)))
+
+
+def build_synthetic(name, folder, scale):
+    files, generator = SYNTHETIC[name]
+    rng = random.Random(f"{SEED}-{name}")
+    folder.mkdir(parents=True)
+    for i in range(max(1, int(files * scale))):
+        sub = folder / f"pkg{i % 10}"
+        sub.mkdir(exist_ok=True)
+        (sub / f"module{i}.py").write_text(generator(rng, scale))
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def timed_batch(items):
+    """Pool task of a run: transform_batch, with the time each file took, and the peak RSS of the worker."""
+    from analyzer import transform_helper
+    results = []
+    for item in items:
+        start = time.perf_counter()
+        res = transform_helper(*item)
+        results.append((res[0], res[1], time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    return results
+
+
+def run_one(corpus, jobs, backend, start_method):
+    """Transforms the corpus in place, in this process. Returns the measurements as a dict."""
+    import concurrent.futures
+    import multiprocessing
+    from analyzer import init_worker
+    from analyzer.discovery import discover
+    from analyzer.scheduler import run_batches, stream_batches
+
+    latencies = []
+    visited = transformed = 0
+    first_result = None
+    workers_rss = 0
+    start = time.perf_counter()
+    if backend == "threads":
+        executor = concurrent.futures.ThreadPoolExecutor(jobs, initializer=init_worker)
+    else:
+        context = multiprocessing.get_context(start_method) if start_method else None
+        executor = concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context, initializer=init_worker)
+    with executor:
+        items = (((f, None, None), size) for f, size in discover(corpus, use_gitignore=False))
+        batches = ([item for item, _ in batch] for batch in stream_batches(items, size_of=lambda pair: pair[1]))
+        for _, (nodes, new_nodes, seconds, rss) in run_batches(executor, timed_batch, batches, max_in_flight=4 * jobs):
+            if first_result is None:
+                first_result = time.perf_counter() - start
+            visited += nodes
+            transformed += new_nodes
+            latencies.append(seconds)
+            workers_rss = max(workers_rss, rss)
+    wall = time.perf_counter() - start
+
+    return {
+        "files": len(latencies),
+        "if_nodes": visited,
+        "transformed_nodes": transformed,
+        "wall_s": wall,
+        "first_result_s": first_result,
+        "files_per_s": len(latencies) / wall if wall else None,
+        "if_nodes_per_s": visited / wall if wall else None,
+        "latency_ms": {f"p{p}": percentile(latencies, p) * 1000 for p in (50, 90, 99)} if latencies else {},
+        "latency_max_ms": max(latencies) * 1000 if latencies else None,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_main_MiB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        # Threads share the main process
+        "peak_rss_worker_MiB": workers_rss / 1024 if backend != "threads" else None,
+    }
+
+
+def measure(corpus, jobs, args, scratch):
+    """Runs run_one in a fresh process, on a fresh copy of the corpus, with an empty cache. Returns its measurements."""
+    copy = scratch / "copy"
+    if copy.exists():
+        shutil.rmtree(copy)
+    shutil.copytree(corpus, copy, symlinks=True, ignore=shutil.ignore_patterns("__pycache__"))
+    cache = tempfile.mkdtemp(dir=scratch)
+    env = dict(os.environ, XDG_CACHE_HOME=cache)
+    proc = subprocess.run([sys.executable, __file__, "--run-one", str(copy), str(jobs), args.backend, args.start_method or ""],
+                          stdout=subprocess.PIPE, env=env, cwd=REPO)
+    shutil.rmtree(cache, ignore_errors=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Benchmark run failed on {corpus} with {jobs} workers")
+    return json.loads(proc.stdout.decode().splitlines()[-1])
+
+
+def timed_process(command, env, cwd):
+    start = time.perf_counter()
+    proc = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env, cwd=cwd)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Benchmark command failed: {' '.join(command)}")
+    return time.perf_counter() - start
+
+
+def measure_startup(corpus, repeat, scratch):
+    """
+    Returns the median wall times of starting the interpreter, importing the analyzer, and transforming one file of the corpus
+    inline with the CLI (time to first file), each in a fresh process, with an empty cache.
+    """
+    source = min(Path(corpus).rglob("*.py"))
+    times = {"interpreter_s": [], "import_s": [], "first_file_s": []}
+    for _ in range(repeat):
+        folder = scratch / "startup"
+        if folder.exists():
+            shutil.rmtree(folder)
+        folder.mkdir()
+        file = folder / source.name
+        shutil.copyfile(source, file)
+        env = dict(os.environ, XDG_CACHE_HOME=str(folder / "cache"))
+        times["interpreter_s"].append(timed_process([sys.executable, "-c", "pass"], env, REPO))
+        times["import_s"].append(timed_process([sys.executable, "-c", "import analyzer"], env, REPO))
+        times["first_file_s"].append(timed_process([sys.executable, str(REPO), "-i", str(file)], env, folder))
+    return {name: percentile(values, 50) for name, values in times.items()}
+
+
+def median_run(runs):
+    """The run with the median wall time, so every reported number comes from a real run."""
+    return sorted(runs, key=lambda run: run["wall_s"])[len(runs) // 2]
+
+
+def compare(results, baseline, tolerance):
+    """Returns the list of regressions: runs, whose throughput dropped more than tolerance relative to the baseline."""
+    regressions = []
+    old = {(r["corpus"], r["jobs"]): r for r in baseline["runs"]}
+    for run in results["runs"]:
+        base = old.get((run["corpus"], run["jobs"]))
+        if base is None or not base["files_per_s"]:
+            continue
+        change = run["files_per_s"] / base["files_per_s"] - 1
+        run["change_vs_baseline"] = change
+        if change < -tolerance:
+            regressions.append(run)
+    return regressions
+
+
+def default_jobs():
+    from analyzer.scheduler import default_workers
+    cpus = default_workers()
+    jobs = [1]
+    while jobs[-1] * 2 <= cpus:
+        jobs.append(jobs[-1] * 2)
+    if jobs[-1] != cpus:
+        jobs.append(cpus)
+    return jobs
+
+
+def print_run(run):
+    latency = run["latency_ms"]
+    rss = run["peak_rss_worker_MiB"]
+    change = run.get("change_vs_baseline")
+    print(f"{run['corpus']:<24} {run['jobs']:>3} {run['files']:>7} {run['files_per_s']:>9.1f} {run['if_nodes_per_s']:>10.1f} "
+          f"{latency.get('p50', 0):>8.2f} {latency.get('p90', 0):>8.2f} {latency.get('p99', 0):>8.2f} "
+          f"{run['peak_rss_main_MiB']:>8.1f} {rss if rss is not None else float('nan'):>8.1f}"
+          + (f" {change:+.1%}" if change is not None else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks transpy on synthetic and local corpora.")
+    parser.add_argument("--corpus", action="append", default=[], metavar="PATH", help="local folder to benchmark on (can be given more than once)")
+    parser.add_argument("--synthetic", nargs="*", default=None, choices=sorted(SYNTHETIC), metavar="NAME",
+                        help=f"synthetic corpora to build: {', '.join(sorted(SYNTHETIC))} (default: all, or none if --corpus is given)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the size of the synthetic corpora")
+    parser.add_argument("-j", "--jobs", type=int, action="append", default=None, help="worker count to measure (can be given more than once, default: 1, 2, 4.. up to the CPUs)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per measurement, the median one is reported")
+    parser.add_argument("-b", "--backend", choices=("processes", "threads"), default="processes")
+    parser.add_argument("-s", "--start-method", default=None)
+    parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare to the results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed drop in files/s compared to the baseline (default: 0.10)")
+    parser.add_argument("--run-one", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        corpus, jobs, backend, start_method = args.run_one
+        print(json.dumps(run_one(corpus, int(jobs), backend, start_method or None)))
+        return 0
+
+    names = args.synthetic if args.synthetic is not None else ([] if args.corpus else sorted(SYNTHETIC))
+    jobs_list = args.jobs or default_jobs()
+    results = {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "backend": args.backend,
+        "scale": args.scale,
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="transpy-bench-") as tmp:
+        scratch = Path(tmp)
+        corpora = []
+        for name in names:
+            folder = scratch / "synthetic" / name
+            build_synthetic(name, folder, args.scale)
+            corpora.append((name, folder))
+        for path in args.corpus:
+            corpora.append((Path(path).resolve().name, Path(path).resolve()))
+
+        print(f"{'corpus':<24} {'j':>3} {'files':>7} {'files/s':>9} {'nodes/s':>10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'main MiB':>8} {'wrkr MiB':>8}")
+        if corpora:
+            results["startup"] = measure_startup(corpora[0][1], args.repeat, scratch)
+            startup = results["startup"]
+            print(f"startup: interpreter {startup['interpreter_s'] * 1000:.1f} ms, import {startup['import_s'] * 1000:.1f} ms, "
+                  f"first file {startup['first_file_s'] * 1000:.1f} ms ({corpora[0][0]})")
+
+        for name, folder in corpora:
+            for jobs in jobs_list:
+                run = median_run([measure(folder, jobs, args, scratch) for _ in range(args.repeat)])
+                run.update(corpus=name, jobs=jobs)
+                results["runs"].append(run)
+                if not args.baseline:
+                    print_run(run)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for run in results["runs"]:
+            print_run(run)
+        for run in regressions:
+            print(f"REGRESSION: {run['corpus']} with {run['jobs']} workers: {run['change_vs_baseline']:+.1%} files/s")
+        slower_start = None
+        if "startup" in results and baseline.get("startup"):
+            slower_start = results["startup"]["first_file_s"] / baseline["startup"]["first_file_s"] - 1
+            results["startup"]["change_vs_baseline"] = slower_start
+            if slower_start > args.tolerance:
+                print(f"REGRESSION: time to first file: {slower_start:+.1%}")
+        status = 1 if regressions or (slower_start is not None and slower_start > args.tolerance) else 0
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Results written to {args.save}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())